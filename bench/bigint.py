@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+'''
+Time the conversions of ost_bigint against the plain loops B used before
+(and Python's own str and int, with its digit limit lifted), on random
+numbers of growing size:
+
+    python3 bench/bigint.py --digits 1000 10000 100000
+'''
+
+# namespace shenanigans
+import sys, os
+sys.path.insert(1, os.path.join(sys.path[0], '..') + '/lib')
+
+import random, time
+
+import ost_bigint
+
+
+def plain_digits(n, base):
+    ds = []
+    while n:
+        n, d = divmod(n, base)
+        ds.append(d)
+    return ds[::-1]
+
+def plain_undigits(ds, base):
+    num = 0
+    for d in ds:
+        num *= base
+        num += d
+    return num
+
+
+# (name, the plain way, the ost_bigint way), each run on a number n
+def cases(n):
+    tens = ost_bigint.digits(n, 10)
+    text = str(n)
+    return [
+        ('digits 10', lambda: plain_digits(n, 10),
+         lambda: ost_bigint.digits(n, 10)),
+        ('digits 2', lambda: plain_digits(n, 2),
+         lambda: ost_bigint.digits(n, 2)),
+        ('undigits 10', lambda: plain_undigits(tens, 10),
+         lambda: ost_bigint.undigits(tens, 10)),
+        ('str', lambda: str(n), lambda: ost_bigint.decimal(n)),
+        ('int', lambda: int(text), lambda: ost_bigint.parse(text)),
+    ]
+
+
+def seconds(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    # parse command line arguments
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='compare big int conversions with the plain ones'
+    )
+    parser.add_argument(
+        '--digits', type=int, nargs='+', default=[1000, 10000, 50000],
+        help='how many decimal digits the numbers have'
+    )
+
+    args = parser.parse_args()
+    sys.set_int_max_str_digits(0)
+    random.seed(0)
+    print('%8s %-12s %10s %10s %8s' % ('digits', 'conversion', 'plain',
+                                      'ost_bigint', 'speedup'))
+    for size in args.digits:
+        n = random.randrange(10 ** (size - 1), 10 ** size)
+        for name, plain, fast in cases(n):
+            before, after = seconds(plain), seconds(fast)
+            print('%8d %-12s %9.4fs %9.4fs %7.1fx' % (size, name, before,
+                                                     after, before / after))
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+'''
+Count which pairs of tokens the interpreter runs one right after the other,
+over the benchmark programs and the differential corpus (or the programs
+given). The most frequent pairs are the candidates for superinstructions
+(see ost_optimize.NUMBER_OPS).
+
+    python3 bench/pairs.py --top 20
+'''
+
+# namespace shenanigans
+import sys, os
+sys.path.insert(1, os.path.join(sys.path[0], '..') + '/lib')
+sys.path.insert(1, os.path.join(sys.path[0], '..') + '/test')
+
+import io
+from collections import Counter
+
+import ost_stack, ost_tokenizer, ostrich
+import differential, run
+
+
+class PairCounter:
+    '''
+    A tracer (see ost_profile.Tracer) that looks at the token the engine is
+    about to run, and counts it together with the one the same run of the
+    engine ran before it.
+    '''
+
+    def __init__(self):
+        self.pairs = Counter()
+        self.previous = []
+
+    def enter(self, code):
+        self.previous.append(None)
+
+    def call(self, name):
+        self.previous.append(None)
+
+    def leave(self):
+        self.previous.pop()
+
+    def splice(self, length, pos):
+        pass
+
+    def tick(self, pos):
+        # Ostrich#interpret keeps its tokens in a local
+        token = name(sys._getframe(1).f_locals['tokens'][pos])
+        if self.previous[-1] is not None:
+            self.pairs[self.previous[-1], token] += 1
+        self.previous[-1] = token
+
+
+# how a token is shown: numbers below 10 and instructions as they are
+def name(token):
+    kind, val = token
+    if kind == TOK.NUMBER:
+        return str(val) if 0 <= val < 10 else 'N'
+    if kind == TOK.ASSIGN:
+        return ':' + val
+    if kind == TOK.LITERAL:
+        return '{}' if type(val) is ost_stack.Block else '``'
+    return repr(val)[1:-1] if val in ' \n' else val
+
+
+def count(programs):
+    counter = PairCounter()
+    for code in programs:
+        program = ostrich.Ostrich(vectorize=False, optimize=False, stdin=io.StringIO(
+            differential.INPUT), stdout=io.StringIO())
+        program.tracer = counter
+        try:
+            program.call(code)
+        except Exception:
+            pass
+    return counter.pairs
+
+
+TOK = ost_tokenizer.TOKENS
+
+if __name__ == '__main__':
+    # parse command line arguments
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='count the pairs of tokens Ostrich programs run'
+    )
+    parser.add_argument(
+        'programs', nargs='*', metavar='program',
+        help='programs to run (default: the benchmarks and the corpus)'
+    )
+    parser.add_argument(
+        '--top', type=int, default=30, help='how many pairs to show'
+    )
+
+    args = parser.parse_args()
+    programs = args.programs or [code for _, code in run.programs()] + \
+        differential.CORPUS
+    pairs = count(programs)
+    total = sum(pairs.values())
+    for (first, second), n in pairs.most_common(args.top):
+        print('%-6s %-6s %10d %5.1f%%' % (first, second, n, 100 * n / total))
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+
+'''
+Run the Ostrich programs in this directory and report how long they take
+and how much memory they need at their peak, optionally saving the results
+as a JSON baseline or comparing them with one. When several engines are
+run, every engine after the first is compared with the first.
+'''
+
+# namespace shenanigans
+import sys, os
+sys.path.insert(1, os.path.join(sys.path[0], '..') + '/lib')
+
+import gc, glob, hashlib, io, json, platform, statistics, time, tracemalloc
+
+import ost_cache, ost_vm, ostrich
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def programs(names=None):
+    '''
+    The benchmark programs as (name, code) pairs, sorted by name; all of
+    them, or just the ones whose names are given.
+    '''
+    paths = sorted(glob.glob(os.path.join(BENCH_DIR, '*.ost')))
+    found = {os.path.basename(path)[:-4]: path for path in paths}
+    if names:
+        missing = [name for name in names if name not in found]
+        if missing:
+            sys.exit('run.py: no such benchmark: %s' % ', '.join(missing))
+        found = {name: found[name] for name in names}
+    return [(name, open(path).read()) for name, path in sorted(found.items())]
+
+
+# run code once on a fresh interpreter, with empty input and captured
+# output; returns the seconds it took and what it printed
+def run_once(code, engine):
+    out = io.StringIO()
+    program = ostrich.Ostrich(engine=engine, stdin=io.StringIO(''),
+                              stdout=out)
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        rendered = program.run(code)
+        elapsed = time.perf_counter() - start
+    finally:
+        if enabled: gc.enable()
+    program.output.flush()
+    return elapsed, out.getvalue() + rendered
+
+
+def peak_memory(code, engine):
+    tracemalloc.start()
+    try:
+        run_once(code, engine)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(code, engine, repeat=5, memory=True):
+    '''
+    Time `repeat` runs of code after one warmup run (which also fills the
+    caches). Peak memory is measured in a run of its own, as tracing
+    allocations slows everything down.
+    '''
+    ost_cache.parsed.clear()
+    ost_vm.compiled.clear()
+    _, output = run_once(code, engine)
+    times = [run_once(code, engine)[0] for _ in range(repeat)]
+    result = {
+        'median': statistics.median(times),
+        'min': min(times),
+        'max': max(times),
+        # the output is only kept as a hash, to notice when it changes
+        'output': hashlib.sha1(output.encode('utf-8')).hexdigest()[:12],
+    }
+    if memory:
+        result['peak'] = peak_memory(code, engine)
+    return result
+
+
+def run_all(names=None, engines=('ref',), repeat=5, memory=True,
+            log=None):
+    results = {}
+    for name, code in programs(names):
+        results[name] = {}
+        for engine in engines:
+            results[name][engine] = measure(code, engine, repeat, memory)
+            if log: log(name, engine, results[name][engine])
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(old, new, threshold=0.1):
+    '''
+    The differences between two measurements of one benchmark that count
+    as regressions: a median time or peak memory more than `threshold`
+    (relative) above the old one, or a different output.
+    '''
+    problems = []
+    if old['output'] != new['output']:
+        problems.append('output changed')
+    if new['median'] > old['median'] * (1 + threshold):
+        problems.append('time %+.1f%%' % (
+            100 * (new['median'] / old['median'] - 1)))
+    if 'peak' in old and 'peak' in new and \
+            new['peak'] > old['peak'] * (1 + threshold):
+        problems.append('memory %+.1f%%' % (
+            100 * (new['peak'] / old['peak'] - 1)))
+    return problems
+
+
+def regressions(baseline, current, threshold=0.1):
+    '''
+    (benchmark, engine, problems) for every benchmark run in both that got
+    worse from baseline to current.
+    '''
+    found = []
+    for name, engines in sorted(current['results'].items()):
+        for engine, new in sorted(engines.items()):
+            old = baseline['results'].get(name, {}).get(engine)
+            if old is not None:
+                problems = compare(old, new, threshold)
+                if problems:
+                    found.append((name, engine, problems))
+    return found
+
+
+def engine_regressions(current, engines, threshold=0.1):
+    '''
+    The same for every engine after the first, against the first one.
+    '''
+    found = []
+    for name, results in sorted(current['results'].items()):
+        for engine in engines[1:]:
+            problems = compare(results[engines[0]], results[engine],
+                               threshold)
+            if problems:
+                found.append((name, '%s vs %s' % (engine, engines[0]),
+                              problems))
+    return found
+
+
+def line(name, engine, result):
+    return '%-14s %-4s %9.4fs %9.4fs %9.4fs %10s  %s' % (
+        name, engine, result['median'], result['min'], result['max'],
+        '%dK' % (result['peak'] // 1024) if 'peak' in result else '-',
+        result['output'])
+
+
+if __name__ == '__main__':
+    # parse command line arguments
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='run the Ostrich benchmarks'
+    )
+    parser.add_argument(
+        'names', nargs='*', metavar='name',
+        help='benchmarks to run (default: all *.ost files in %s)' % BENCH_DIR
+    )
+    parser.add_argument(
+        '--engine', action='append', choices=ostrich.Ostrich.ENGINES,
+        help='engine to run them with; give it more than once to compare \
+engines (default: ref)'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='timed runs per benchmark, after one warmup run'
+    )
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help='do not measure peak memory'
+    )
+    parser.add_argument(
+        '--save', metavar='FILE', help='save the results as JSON to FILE'
+    )
+    parser.add_argument(
+        '--compare', metavar='FILE',
+        help='flag regressions against the results saved in FILE'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='how much slower or bigger (relative) counts as a regression'
+    )
+
+    args = parser.parse_args()
+    engines = args.engine or ['ref']
+
+    print('%-14s %-4s %10s %10s %10s %10s  %s' % (
+        'benchmark', 'eng', 'median', 'min', 'max', 'peak', 'output'))
+    current = run_all(args.names, engines, args.repeat, not args.no_memory,
+                      log=lambda *a: print(line(*a), flush=True))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    found = engine_regressions(current, engines, args.threshold)
+    if args.compare:
+        with open(args.compare) as f:
+            found += regressions(json.load(f), current, args.threshold)
+    for name, engine, problems in found:
+        print('REGRESSION %s (%s): %s' % (name, engine, ', '.join(problems)))
+    sys.exit(1 if found else 0)
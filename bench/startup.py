@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+'''
+Measure how long Ostrich takes to start: the wall-clock time of short runs
+of ostrich.py (and of importing it), and what `python -X importtime` says
+each module costs to import. Like run.py, results can be saved as a JSON
+baseline and compared with one, where a run that got slower or imports
+modules it did not import before counts as a regression.
+
+Run it with bytecode caching on (without PYTHONDONTWRITEBYTECODE), as
+real runs are.
+'''
+
+# namespace shenanigans
+import sys, os
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'lib')
+
+import json, platform, statistics, subprocess, tempfile, time
+
+
+# what is started: a name and the arguments for python; `program` is a file
+# with a program as small as the one given with -e
+def runs(program):
+    ostrich = os.path.join(LIB_DIR, 'ostrich.py')
+    return [
+        ('import', ['-c', 'import ostrich']),
+        ('-e', [ostrich, '-e', '1 2+']),
+        ('file', [ostrich, program]),
+        ('options', [ostrich, '--engine', 'vm', '-e', '1 2+']),
+    ]
+
+
+# {module: (cumulative microseconds, whether it was imported at the top
+# level rather than by another module)} from the stderr of -X importtime
+def import_times(stderr):
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative), not name.startswith('  ')
+    return times
+
+
+def measure(args, repeat=20):
+    '''
+    Start python with args `repeat` times (after one warmup run, which also
+    writes the bytecode caches), and return the median wall-clock time and
+    the median import time of every module (leaving out those python
+    imports at startup anyway) and of all of them together.
+    '''
+    command = [sys.executable, '-X', 'importtime'] + args
+    env = dict(os.environ, PYTHONPATH=LIB_DIR)
+    startup = import_times(subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'pass'], env=env,
+        capture_output=True, text=True).stderr)
+    subprocess.run(command, env=env, capture_output=True)
+    walls, samples = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        done = subprocess.run(command, env=env, capture_output=True,
+                              text=True)
+        walls.append(time.perf_counter() - start)
+        samples.append({name: times for name, times in
+                     import_times(done.stderr).items()
+                     if name not in startup})
+    return {
+        'median': statistics.median(walls),
+        'min': min(walls),
+        'imports': statistics.median(
+            sum(us for us, top in run.values() if top) for run in samples),
+        'modules': {name: statistics.median(run.get(name, (0,))[0]
+                                            for run in samples)
+                    for name in samples[0]},
+    }
+
+
+def compare(old, new, threshold=0.1):
+    problems = []
+    if new['median'] > old['median'] * (1 + threshold):
+        problems.append('time %+.1f%%' % (
+            100 * (new['median'] / old['median'] - 1)))
+    if new['imports'] > old['imports'] * (1 + threshold):
+        problems.append('imports %+.1f%%' % (
+            100 * (new['imports'] / old['imports'] - 1)))
+    added = sorted(set(new['modules']) - set(old['modules']))
+    if added:
+        problems.append('now imports %s' % ', '.join(added))
+    return problems
+
+
+if __name__ == '__main__':
+    # parse command line arguments
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='measure how long Ostrich takes to start'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=20,
+        help='runs of each kind, after one warmup run'
+    )
+    parser.add_argument(
+        '--top', type=int, default=8,
+        help='how many of the slowest modules to show per run'
+    )
+    parser.add_argument(
+        '--save', metavar='FILE', help='save the results as JSON to FILE'
+    )
+    parser.add_argument(
+        '--compare', metavar='FILE',
+        help='flag regressions against the results saved in FILE'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='how much slower (relative) counts as a regression'
+    )
+
+    args = parser.parse_args()
+    if sys.flags.dont_write_bytecode or os.environ.get(
+            'PYTHONDONTWRITEBYTECODE'):
+        print('warning: bytecode is not cached, so every run compiles '
+              'Ostrich from source', file=sys.stderr)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.ost') as program:
+        program.write('1 2+')
+        program.flush()
+        results = {name: measure(run, args.repeat)
+                   for name, run in runs(program.name)}
+    for name, _ in runs(None):
+        result = results[name]
+        print('%-8s %8.1fms (min %.1fms), imports %.1fms' % (
+            name, 1000 * result['median'], 1000 * result['min'],
+            result['imports'] / 1000))
+        slowest = sorted(result['modules'].items(), key=lambda kv: -kv[1])
+        for module, us in slowest[:args.top]:
+            print('    %-28s %7.1fms' % (module, us / 1000))
+    current = {'python': platform.python_version(),
+               'platform': platform.platform(), 'repeat': args.repeat,
+               'results': results}
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    found = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for name, new in sorted(results.items()):
+            old = baseline['results'].get(name)
+            if old is not None:
+                found += [(name, compare(old, new, args.threshold))]
+    for name, problems in found:
+        if problems:
+            print('REGRESSION %s: %s' % (name, ', '.join(problems)))
+    sys.exit(1 if any(problems for _, problems in found) else 0)
@@ -6,8 +6,8 @@ import datetime
 
 OUTFILE = '../doc/builtin.md'
 
-instr = ost_instructions.ost_instructions()
-keys = sorted(ost_instructions.ost_instructions().keys())
+instr = ost_instructions.BUILTINS
+keys = sorted(instr.keys())
 
 with open(OUTFILE, 'w') as f:
 
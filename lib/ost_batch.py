@@ -0,0 +1,111 @@
+import io, json, os, signal, sys, time
+
+import ost_budget
+
+
+class TimeLimitExceeded(Exception):
+    pass
+
+
+def on_alarm(signum, frame):
+    raise TimeLimitExceeded('time limit exceeded')
+
+
+def run_job(line, interpreter, options={}, lineno=None):
+    '''
+    Run one job, a line of JSON: an object with `source` and optionally
+    `stdin` (default empty), `time_limit` in seconds and an `id` (default
+    the line number). The program runs on a fresh interpreter(**options)
+    (an Ostrich); the result is a dict with the id, a status (ok, error,
+    timeout, or limit if it ran out of another budget), everything it
+    printed (P output and the final stack, as ostrich.py would print
+    them), the final stack as the REPL shows it, the error if there was
+    one, and the seconds it ran.
+    '''
+    result = {'id': lineno, 'status': 'ok'}
+    try:
+        job = json.loads(line)
+        result['id'] = job.get('id', lineno)
+        source, stdin = job['source'], job.get('stdin', '')
+        if type(source) is not str or type(stdin) is not str:
+            raise ValueError('source and stdin must be strings')
+        limit = job.get('time_limit')
+        if limit is not None and (type(limit) not in (int, float) or
+                                  not limit > 0):
+            raise ValueError('time_limit must be a positive number')
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        result.update(status='error', error='bad job: %r' % e)
+        return result
+
+    out = io.StringIO()
+    program = interpreter(stdin=io.StringIO(stdin), stdout=out, **options)
+    if limit:
+        handler = signal.signal(signal.SIGALRM, on_alarm)
+    start = time.perf_counter()
+    try:
+        if limit:
+            signal.setitimer(signal.ITIMER_REAL, limit)
+        program.call(source)
+        for x in program.stack:
+            program.output.emit(x)
+    except TimeLimitExceeded as e:
+        result.update(status='timeout', error=str(e))
+    except ost_budget.BudgetExceeded as e:
+        result.update(status='timeout' if e.limit == 'time' else 'limit',
+                      error=str(e))
+    except Exception as e:
+        result.update(status='error', error='%s: %s' % (type(e).__name__, e))
+    finally:
+        if limit:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, handler)
+    result['time'] = time.perf_counter() - start
+    program.output.flush()
+    result['stdout'] = out.getvalue()
+    result['stack'] = program.render()
+    return result
+
+
+class Runner:
+    '''
+    run_job for (line number, line) pairs, with the interpreter bound; a
+    class so that it can be sent to the worker processes.
+    '''
+
+    def __init__(self, interpreter, options):
+        self.interpreter = interpreter
+        self.options = options
+
+    def __call__(self, job):
+        lineno, line = job
+        return run_job(line, self.interpreter, self.options, lineno)
+
+
+def run_batch(lines, interpreter, options={}, workers=None):
+    '''
+    Run every job in lines (see run_job; blank lines are skipped) and
+    yield the results in the order they finish. Jobs are spread over a
+    pool of `workers` processes (default: one per CPU), which are started
+    once and run job after job; with one worker they run in this process.
+    '''
+    jobs = ((lineno, line) for lineno, line in enumerate(lines, 1)
+            if line.strip())
+    runner = Runner(interpreter, options)
+    if workers == 1:
+        yield from map(runner, jobs)
+        return
+    import multiprocessing
+    with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+        yield from pool.imap_unordered(runner, jobs)
+
+
+def main(path, interpreter, options={}, workers=None):
+    '''
+    Run the jobs in the JSON lines file at path (- for stdin) and write
+    the results to stdout as JSON lines, each as soon as it is done.
+    '''
+    jobs = sys.stdin if path == '-' else open(path)
+    with jobs:
+        for result in run_batch(jobs, interpreter, options, workers):
+            sys.stdout.write(json.dumps(result) + '\n')
+            sys.stdout.flush()
@@ -0,0 +1,129 @@
+# conversions between big ints and their digits (in any base) or decimal
+# strings. The plain loops take time quadratic in the number of digits, and
+# Python refuses to convert ints with more than sys.get_int_max_str_digits()
+# digits to or from str at all; these split numbers in halves by a power of
+# the base instead, so that the big multiplications and divisions do most
+# of the work
+
+# the plain loops are run on this many digits at a time
+LEAF = 16
+
+# decimal strings are converted this many digits at a time, well below
+# Python's limit
+CHUNK = 1000
+BASE = 10 ** CHUNK
+
+# ints of at most this many bits have fewer than CHUNK digits
+SMALL_BITS = 3000
+
+# format codes for the power-of-two bases Python formats itself, by the
+# number of bits in a digit, and how their characters map back to digits
+FORMATS = {1: 'b', 3: 'o', 4: 'x'}
+HEXDIGITS = bytes.maketrans(b'0123456789abcdef', bytes(range(16)))
+
+
+def digits(n, base):
+    '''
+    The digits of n >= 0 in base >= 2, most significant first; none for 0.
+    '''
+    if base & (base - 1) == 0:
+        return binary_digits(n, base.bit_length() - 1)
+    result = []
+    if n.bit_length() <= (base.bit_length() - 1) * LEAF:
+        # at most LEAF digits
+        split(n, base, None, -1, False, result)
+        return result
+    # powers[i] is base ** (LEAF << i)
+    powers = [base ** LEAF]
+    while powers[-1].bit_length() * 2 <= n.bit_length():
+        powers.append(powers[-1] * powers[-1])
+    if powers[-1] * powers[-1] <= n:
+        powers.append(powers[-1] * powers[-1])
+    split(n, base, powers, len(powers) - 1, False, result)
+    return result
+
+# append the digits of n < powers[i] ** 2 to result, padded with zeros to
+# LEAF << (i + 1) digits if pad
+def split(n, base, powers, i, pad, result):
+    if i < 0:
+        leaf = []
+        while n:
+            n, d = divmod(n, base)
+            leaf.append(d)
+        if pad:
+            leaf.extend([0] * (LEAF - len(leaf)))
+        result.extend(reversed(leaf))
+        return
+    hi, lo = divmod(n, powers[i])
+    if hi or pad:
+        split(hi, base, powers, i - 1, pad, result)
+    split(lo, base, powers, i - 1, pad or hi > 0, result)
+
+# the digits of n in base 2 ** bits, cut out of its binary representation
+def binary_digits(n, bits):
+    if not n:
+        return []
+    if bits in FORMATS:
+        return list(format(n, FORMATS[bits]).encode().translate(HEXDIGITS))
+    text = format(n, 'b')
+    text = '0' * (-len(text) % bits) + text
+    return [int(text[i:i + bits], 2) for i in range(0, len(text), bits)]
+
+
+def undigits(ds, base):
+    '''
+    The number with the digits ds in base, most significant first; the
+    digits and the base may be any ints. This undoes digits().
+    '''
+    first = len(ds) % LEAF
+    values = [horner(ds[:first], base)] if first else []
+    values += [horner(ds[i:i + LEAF], base)
+               for i in range(first, len(ds), LEAF)]
+    # combine neighbours from the end, so that every value but the first
+    # stands for the same number of digits
+    shift = LEAF * (base.bit_length() - 1) \
+        if base > 1 and base & (base - 1) == 0 else None
+    power = base ** LEAF if len(values) > 1 else None
+    while len(values) > 1:
+        odd = len(values) % 2
+        pairs = zip(values[odd::2], values[odd + 1::2])
+        if shift is not None:
+            values[odd:] = [(hi << shift) + lo for hi, lo in pairs]
+            shift *= 2
+        else:
+            values[odd:] = [hi * power + lo for hi, lo in pairs]
+            if len(values) > 1:
+                power *= power
+    return values[0] if values else 0
+
+def horner(ds, base):
+    num = 0
+    for d in ds:
+        num = num * base + d
+    return num
+
+
+def decimal(n):
+    '''
+    str(n), for an int with any number of digits.
+    '''
+    if n.bit_length() <= SMALL_BITS:
+        return str(n)
+    pieces = digits(abs(n), BASE)
+    return ('-' if n < 0 else '') + str(pieces[0]) + \
+        ''.join(['%0*d' % (CHUNK, piece) for piece in pieces[1:]])
+
+
+def parse(s):
+    '''
+    int(s), for a decimal string with any number of digits.
+    '''
+    text = s.strip()
+    body = text[1:] if text[:1] in ('+', '-') else text
+    if len(body) <= CHUNK or not (body.isascii() and body.isdigit()):
+        return int(s)
+    first = len(body) % CHUNK
+    pieces = [int(body[:first])] if first else []
+    pieces += [int(body[i:i + CHUNK]) for i in range(first, len(body), CHUNK)]
+    n = undigits(pieces, BASE)
+    return -n if text[0] == '-' else n
@@ -0,0 +1,133 @@
+import sys, time
+
+import ost_stack
+
+
+# time and memory are checked once every this many instructions
+CHECK_EVERY = 1024
+
+
+class BudgetExceeded(Exception):
+    '''
+    Raised when a program runs out of its budget. `limit` is the budget
+    that ran out (instructions, time, memory or depth) and `stack` the
+    stack at that point.
+    '''
+
+    def __init__(self, limit, stack):
+        self.limit = limit
+        self.stack = list(stack)
+        shown = ' '.join(map(OS.inspect, self.stack))
+        if len(shown) > 200:
+            shown = shown[:197] + '...'
+        super().__init__('%s budget exceeded; stack: %s' % (limit, shown))
+
+
+class Budget:
+    '''
+    Limits on one run of a program: how many instructions it may execute
+    (blocks run by builtins count one extra each, so that even empty
+    blocks use up the budget), for how many seconds it may run and about
+    how many bytes the stack may take up. Every limit may be None. See
+    Ostrich(max_instructions=..., time_limit=..., max_memory=...).
+    '''
+
+    def __init__(self, max_instructions=None, time_limit=None,
+                 max_memory=None):
+        self.max_instructions = max_instructions
+        self.time_limit = time_limit
+        self.max_memory = max_memory
+        self.depth = 0  # how many calls are running
+        self.count = 0
+        self.limit = self.check_at = self.deadline = None
+        self.used = 0  # bytes on the stack when it was last measured
+
+    # a (block) call starts; the outermost one starts the budget
+    def enter(self, prgm):
+        if not self.depth:
+            self.count = 0
+            self.limit = float('inf') if self.max_instructions is None \
+                else self.max_instructions
+            self.check_at = CHECK_EVERY
+            self.used = 0
+            self.deadline = None if self.time_limit is None \
+                else time.monotonic() + self.time_limit
+        self.depth += 1
+        self.tick(prgm)
+
+    def leave(self):
+        self.depth -= 1
+
+    # one more instruction is about to run
+    def tick(self, prgm):
+        self.count += 1
+        if self.count > self.limit:
+            raise BudgetExceeded('instructions', prgm.stack)
+        if self.count >= self.check_at:
+            self.check(prgm)
+
+    # n more instructions run at once, by optimized code (see ost_optimize);
+    # False, and nothing counted, if they do not all fit
+    def charge(self, prgm, n):
+        if self.count + n > self.limit:
+            return False
+        self.count += n
+        if self.count >= self.check_at:
+            self.check(prgm)
+        return True
+
+    def check(self, prgm):
+        self.check_at = self.count + CHECK_EVERY
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise BudgetExceeded('time', prgm.stack)
+        if self.max_memory is not None:
+            self.used = stack_size(prgm.stack)
+            self.allocate(prgm, 0)
+
+    # the last tick was for optimized code that runs token by token after
+    # all, each token with a tick of its own
+    def untick(self):
+        self.count -= 1
+
+    def allocate(self, prgm, nbytes):
+        '''
+        Raise if the stack would take up more than the memory budget with
+        nbytes more. The stack is only measured again when it looks like it
+        would.
+        '''
+        if self.max_memory is not None and \
+                nbytes + self.used > self.max_memory:
+            self.used = stack_size(prgm.stack)
+            if nbytes + self.used > self.max_memory:
+                raise BudgetExceeded('memory', prgm.stack)
+
+
+def size(x):
+    '''
+    About how many bytes x takes up. The elements of arrays are counted as
+    small numbers and not looked at, so that this stays cheap.
+    '''
+    if type(x) is list:
+        return sys.getsizeof(x) + 32 * len(x)
+    if type(x) is rope:
+        return x.length + 64
+    return sys.getsizeof(x)
+
+def stack_size(stk):
+    return sum(map(size, stk))
+
+
+def parse_size(text):
+    '''
+    A number of bytes from a string like 4096, 64K, 512M or 2G.
+    '''
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# just for convenience
+OS = ost_stack.Stack
+rope = ost_stack.Rope
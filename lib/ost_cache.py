@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+import ost_tokenizer
+
+
+class LRUCache:
+    '''
+    A bounded map from code (program or block text) to its parsed or
+    compiled form. The least recently used entry is evicted once `maxsize`
+    entries are stored. Cached values are shared and must never be mutated.
+    '''
+
+    def __init__(self, build, maxsize=1024):
+        self.build = build
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __call__(self, code):
+        try:
+            value = self.entries[code]
+        except KeyError:
+            self.misses += 1
+            value = self.entries[code] = self.build(code)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(code)
+        return value
+
+    # store value for code as if it had been built, e.g. when it was loaded
+    # from somewhere else
+    def put(self, code, value):
+        self.entries[code] = value
+        self.entries.move_to_end(code)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self.entries) > maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {'size': len(self.entries), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+# token lists for Ostrich#interpret; ost_vm keeps its own cache of bytecode
+parsed = LRUCache(ost_tokenizer.tokenize)
@@ -0,0 +1,175 @@
+import marshal, os, zlib
+
+import ost_cache, ost_stack, ost_tokenizer, ost_vm
+
+
+# how many bytes of cached programs are kept by default
+MAXSIZE = 32 << 20
+
+SUFFIX = '.ostc'
+
+
+def default_directory():
+    '''
+    $OSTRICH_CACHE_DIR, or ostrich/ in $XDG_CACHE_HOME (default ~/.cache).
+    '''
+    if os.environ.get('OSTRICH_CACHE_DIR'):
+        return os.environ['OSTRICH_CACHE_DIR']
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                        os.path.join(os.path.expanduser('~'), '.cache'),
+                        'ostrich')
+
+
+class DiskCache:
+    '''
+    The parsed (engine ref) or compiled (engine vm) form of whole programs
+    and of every block literal in them, kept in files in `directory` much
+    like Python keeps bytecode in .pyc files. A program found there goes
+    straight into the in-memory caches (ost_cache.parsed, ost_vm.compiled),
+    so it is not parsed again when it runs.
+
+    A file is named after the engine, the interpreter version and a CRC of
+    the source, and holds the source itself, so that a CRC collision is
+    only a miss. Once the files take up more than `maxsize` bytes, the
+    least recently used are deleted. Any file that cannot be read or
+    written is treated as a miss: the cache never stops a program from
+    running.
+    '''
+
+    def __init__(self, version, directory=None, maxsize=MAXSIZE):
+        self.version = tuple(version)
+        self.directory = directory or default_directory()
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+
+    def path(self, code, engine):
+        return os.path.join(self.directory, '%s-%s-%08x%s' % (
+            engine, '.'.join(map(str, self.version)),
+            zlib.crc32(code.encode('utf-8', 'surrogatepass')), SUFFIX))
+
+    def prepare(self, code, engine):
+        '''
+        Get code ready to run on engine: load it from the cache, or parse
+        it and store it there.
+        '''
+        if self.load(code, engine):
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.store(code, engine)
+
+    def load(self, code, engine):
+        path = self.path(code, engine)
+        try:
+            # much faster than marshal.load, which reads the file in pieces
+            with open(path, 'rb') as f:
+                version, source, entries = marshal.loads(f.read())
+            os.utime(path)  # its mtime is when it was last used
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        if tuple(version) != self.version or source != code:
+            return False
+
+        memory = ost_vm.compiled if engine == 'vm' else ost_cache.parsed
+        fit(memory, len(entries))
+        if engine == 'vm':
+            for text, ops, consts, blocks in entries:
+                for i in blocks:
+                    consts[i] = block(consts[i])
+                memory.put(text, ost_vm.Code(ops, consts))
+        else:
+            for text, tokens, blocks in entries:
+                for i in blocks:
+                    tokens[i] = (TOK.LITERAL, block(tokens[i][1]))
+                memory.put(text, tokens)
+        return True
+
+    def store(self, code, engine):
+        # marshal only writes plain strings, so blocks are stored as the
+        # indices of the ones to turn back into blocks; the program comes
+        # last, as the most recently used entry of the in-memory caches
+        entries = []
+        found = literals(code)
+        memory = ost_vm.compiled if engine == 'vm' else ost_cache.parsed
+        fit(memory, len(found))
+        for text, tokens in reversed(found):
+            text = str(text)
+            if engine == 'vm':
+                compiled = ost_vm.assemble(tokens)
+                memory.put(text, compiled)
+                entries.append((text, compiled.ops, [
+                    str(x) if type(x) is block else x
+                    for x in compiled.consts], [
+                    i for i, x in enumerate(compiled.consts)
+                    if type(x) is block]))
+            else:
+                memory.put(text, tokens)
+                entries.append((text, [
+                    (kind, str(val)) if type(val) is block else (kind, val)
+                    for kind, val in tokens], [
+                    i for i, (_, val) in enumerate(tokens)
+                    if type(val) is block]))
+
+        # written to a file of its own first, so that no other process
+        # ever reads half a file
+        path = self.path(code, engine)
+        partial = '%s.%d' % (path, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(partial, 'wb') as f:
+                marshal.dump((self.version, code, entries), f)
+            os.replace(partial, path)
+            self.evict()
+        except (OSError, ValueError):
+            try:
+                os.unlink(partial)
+            except OSError:
+                pass
+
+    def evict(self):
+        '''
+        Delete the least recently used files until the rest fit in maxsize.
+        '''
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(SUFFIX):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # deleted by another process
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.maxsize:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+# make room for n entries in an in-memory cache; a program whose literals
+# did not all fit would parse some of them again
+def fit(memory, n):
+    if memory.maxsize < n:
+        memory.resize(n)
+
+
+def literals(code):
+    '''
+    (text, tokens) for code and for every block literal in it, however
+    deeply nested, each once.
+    '''
+    found, todo = {}, [code]
+    while todo:
+        text = todo.pop()
+        if text not in found:
+            tokens = found[text] = ost_tokenizer.tokenize(text)
+            todo.extend(val for _, val in tokens if type(val) is block)
+    return list(found.items())
+
+
+# just for convenience
+block = ost_stack.Block
+TOK = ost_tokenizer.TOKENS
@@ -1,22 +1,49 @@
 from collections import defaultdict
-import random, sys, time, re, math
 
-import ost_stack
+# random, time, re and math are imported by the builtins that use them, so
+# that programs that do not need them do not wait for them to load
+import ost_budget, ost_numeric, ost_stack
 
 
 # utility methods
 def uniq(s):
     # http://stackoverflow.com/q/480214/1223693
     seen = set()
-    return [x for x in s if x not in seen and not seen.add(x)]
+    return [x for x, k in zip(s, map(frozen, s))
+            if k not in seen and not seen.add(k)]
 
 
+# a hashable stand-in for a value, equal to another value's exactly when the
+# values are equal; arrays become tuples, which are never Ostrich values
+def frozen(x):
+    if type(x) is list:
+        return tuple(map(frozen, x))
+    if type(x) is numarray:
+        return tuple(x)
+    return x
+
+
+# for fast membership tests that still keep the order of the operands
+def keyset(xs):
+    return set(map(frozen, xs))
+
+
+# builtins that build something big from something small ask first whether
+# about nbytes more fit in the memory budget (see ost_budget)
+def allocate(prgm, nbytes):
+    if prgm.budget is not None:
+        prgm.budget.allocate(prgm, nbytes)
+
+
+# what any character without a builtin (or variable) does: nothing
+def unknowninstr(self, stk, prgm):
+    pass
+
+
+# builds a fresh dict of all builtins; the interpreter uses the TABLE below,
+# which is built from this once at import
 def ost_instructions():
-    def unknowninstr():
-        def unknowninstr_inner(self, stk, prgm):
-            pass
-        return unknowninstr_inner
-    INSTRUCTIONS = defaultdict(unknowninstr)
+    INSTRUCTIONS = {}
 
     def whitespace(self, stk, prgm):
         '''
@@ -61,8 +88,14 @@ def ost_instructions():
         '''
         Array set.
         '''
-        arr, idx, val = stk.popn(3)
+        arr, idx, val = stk.popn(3, flatten=False)
         atype = OS.typeof(arr)
+        if atype == OST.STRING and idx >= len(arr):
+            # setting past the end of a string appends to it
+            pad = ' ' * (idx - len(arr))
+            stk.append(rope.concat(arr, pad + OS.tostr(val)))
+            return
+        arr, val = OS.flat(arr), OS.flat(val)
         if idx >= len(arr):
             arr += (' ' if atype == OST.STRING else [0]) * (idx - len(arr) + 1)
         val = OS.convert(val, atype)
@@ -77,15 +110,15 @@ def ost_instructions():
         x = stk.pop()
         xt = OS.typeof(x)
         if xt == OST.ARRAY:
-            stk.append(sorted(x))
+            stk.append(numarray('q', sorted(x)) if type(x) is numarray
+                       else sorted(x))
         if xt == OST.STRING:
             stk.append(''.join(sorted(x)))
         if xt == OST.BLOCK:
             toSort = stk.pop()
 
             def sKey(el):
-                prgm.run(OS.inspect(el))
-                prgm.run(x)
+                prgm.call(x, el)
                 stklen = len(stk)
                 rtn = stk.pop()
                 while len(stk) > stklen: stk.pop()
@@ -106,12 +139,16 @@ def ost_instructions():
             elif stype == OST.STRING:
                 pass  # TODO array%string
             elif stype == OST.BLOCK:
+                mapped = ost_numeric.map_block(prgm, p, s)
+                if mapped is not None:
+                    stk.append(mapped)
+                    return
                 marker = len(stk)
                 for x in p:
-                    prgm.run(OS.inspect(x))
-                    prgm.run(s)
-                stk.append(stk[marker:])
-                del stk[marker:-1]
+                    prgm.call(s, x)
+                mapped = stk.popfrom(marker)
+                stk.append(numarray.of(mapped) if type(p) is numarray
+                           else mapped)
             else:
                 split = []
                 prevIdx = 0
@@ -127,10 +164,8 @@ def ost_instructions():
             elif stype == OST.STRING:
                 marker = len(stk)
                 for x in s:
-                    prgm.run(OS.inspect(x))
-                    prgm.run(p)
-                stk.append(stk[marker:])
-                del stk[marker:-1]
+                    prgm.call(p, x)
+                stk.append(stk.popfrom(marker))
             else:
                 pass  # TODO block%block
         elif ptype == OST.STRING:
@@ -150,19 +185,19 @@ def ost_instructions():
         a, b = stk.popn(2)
         ptype = OS.typeof(OS.byprec([a, b])[0])
 
-        # note: enumerable & enumerable does not use set() because
-        # order must be guaranteed
+        # note: enumerable & enumerable keeps the order of the first
+        # operand; sets are only used for membership
         if ptype == OST.ARRAY:
             a1 = OS.convert(a, OST.ARRAY)
-            a2 = OS.convert(b, OST.ARRAY)
-            stk.append([x for x in a1 if x in a2])
+            a2 = keyset(OS.convert(b, OST.ARRAY))
+            stk.append([x for x in a1 if frozen(x) in a2])
         elif ptype == OST.BLOCK:
             s1 = OS.tostr(a)
-            s2 = OS.tostr(b)
+            s2 = set(OS.tostr(b))
             stk.append(block(''.join([c for c in s1 if c in s2])))
         elif ptype == OST.STRING:
             s1 = OS.tostr(a)
-            s2 = OS.tostr(b)
+            s2 = set(OS.tostr(b))
             stk.append(''.join([c for c in s1 if c in s2]))
         elif ptype == OST.NUMBER:
             stk.append(a & b)
@@ -182,8 +217,9 @@ def ost_instructions():
             stk.append(x[1:])
             stk.append(x[0])
         if xt == OST.BLOCK:
-            prgm.run(x)
-            while stk.pop(): prgm.run(x)
+            step = prgm.loop(x)
+            step()
+            while stk.pop(): step()
         if xt == OST.NUMBER:
             stk.append(x - 1)
     INSTRUCTIONS['('] = leftparen
@@ -195,8 +231,9 @@ def ost_instructions():
             stk.append(x[:-1])
             stk.append(x[-1])
         if xt == OST.BLOCK:
-            prgm.run(x)
-            while not stk.pop(): prgm.run(x)
+            step = prgm.loop(x)
+            step()
+            while not stk.pop(): step()
         if xt == OST.NUMBER:
             stk.append(x + 1)
     INSTRUCTIONS[')'] = rightparen
@@ -207,31 +244,36 @@ def ost_instructions():
         ptype, stype = map(OS.typeof, [p, s])
         if ptype == OST.ARRAY:
             if stype == OST.NUMBER:
+                allocate(prgm, 8 * len(p) * s)
                 stk.append(p * s)
             elif stype == OST.STRING:
                 stk.append(s.join(map(OS.tostr, p)))
             elif stype == OST.BLOCK:
+                folded = ost_numeric.fold_block(prgm, p, s)
+                if folded is not None:
+                    stk.append(folded)
+                    return
                 stk.append(p[0])
                 for x in p[1:]:
-                    stk.append(x)
-                    prgm.run(s)
+                    prgm.call(s, x)
             else:
                 joined = [a[0]]
                 for el in a[1:]: joined.extend(b + [el])
                 stk.append(joined)
         elif ptype == OST.BLOCK:
             if stype == OST.NUMBER:
+                step = prgm.loop(p)
                 for _ in range(s):
-                    prgm.run(p)
+                    step()
             elif stype == OST.STRING:
                 stk.append(s[0])
                 for x in s[1:]:
-                    stk.append(x)
-                    prgm.run(p)
+                    prgm.call(p, x)
             else:
                 pass  # TODO block*block
         elif ptype == OST.STRING:
             if stype == OST.NUMBER:
+                allocate(prgm, len(p) * s)
                 stk.append(p * s)
             else:
                 stk.append(b.join(list(a)))
@@ -240,14 +282,19 @@ def ost_instructions():
     INSTRUCTIONS['*'] = times
 
     def plus(self, stk, prgm):
-        a, b = stk.popn(2)
+        # a string that keeps growing is appended to as a rope
+        a, b = stk.popn(2, flatten=False)
         ptype = OS.typeof(OS.byprec([a, b])[0])
+        if prgm.budget is not None and ptype != OST.NUMBER:
+            allocate(prgm, ost_budget.size(a) + ost_budget.size(b))
         if ptype == OST.ARRAY:
+            a, b = OS.flat(a), OS.flat(b)
             stk.append(OS.convert(a, OST.ARRAY) + OS.convert(b, OST.ARRAY))
         elif ptype == OST.BLOCK:
             stk.append(block(OS.tostr(a) + OS.tostr(b)))
         elif ptype == OST.STRING:
-            stk.append(OS.tostr(a) + OS.tostr(b))
+            a = a if type(a) is rope else OS.tostr(a)
+            stk.append(rope.concat(a, OS.tostr(b)))
         elif ptype == OST.NUMBER:
             stk.append(a + b)
     INSTRUCTIONS['+'] = plus
@@ -261,30 +308,31 @@ def ost_instructions():
             toSelect = stk.pop()
             arr = []
             for item in toSelect:
-                prgm.run(OS.inspect(item))
-                prgm.run(x)
+                prgm.call(x, item)
                 if stk.pop():
                     arr.append(item)
-            stk.append(arr)
+            stk.append(numarray('q', arr) if type(toSelect) is numarray
+                       else arr)
         if xt == OST.NUMBER:
-            stk.append(list(range(x)))
+            allocate(prgm, 8 * x)
+            stk.append(numarray('q', range(x)))
     INSTRUCTIONS[','] = comma
 
     def minus(self, stk, prgm):
         a, b = stk.popn(2)
         ptype = OS.typeof(OS.byprec([a, b])[0])
 
-        # note: enumerable - enumerable does not use set() because
-        # order must be guaranteed
+        # note: enumerable - enumerable keeps the order of the first
+        # operand; sets are only used for membership
         if ptype == OST.ARRAY:
             a1 = OS.convert(a, OST.ARRAY)
-            a2 = OS.convert(b, OST.ARRAY)
-            stk.append([x for x in a1 if x not in a2])
+            a2 = keyset(OS.convert(b, OST.ARRAY))
+            stk.append([x for x in a1 if frozen(x) not in a2])
         elif ptype == OST.BLOCK:
             pass  # TODO
         elif ptype == OST.STRING:
             s1 = OS.tostr(a)
-            s2 = OS.tostr(b)
+            s2 = set(OS.tostr(b))
             stk.append(''.join([c for c in s1 if c not in s2]))
         elif ptype == OST.NUMBER:
             stk.append(a - b)
@@ -313,8 +361,7 @@ def ost_instructions():
                 pass  # TODO array/string
             elif stype == OST.BLOCK:
                 for x in p:
-                    prgm.run(OS.inspect(x))
-                    prgm.run(s)
+                    prgm.call(s, x)
             else:
                 split = []
                 prevIdx = 0
@@ -329,8 +376,7 @@ def ost_instructions():
                 pass  # TODO block/number
             elif stype == OST.STRING:
                 for x in s:
-                    prgm.run(OS.inspect(x))
-                    prgm.run(p)
+                    prgm.call(p, x)
             else:
                 pass  # TODO block/block
         elif ptype == OST.STRING:
@@ -342,6 +388,8 @@ def ost_instructions():
             stk.append(a / b)
     INSTRUCTIONS['/'] = div
 
+    # number literals are parsed by the tokenizer; this is only reached when a
+    # digit has been assigned to and a literal is spelled out digit by digit
     def num(self, stk, prgm):
         if prgm.state == OST.NUMBER:
             stk[-1] = int(str(stk[-1]) + self)
@@ -422,8 +470,7 @@ def ost_instructions():
         if ptype == OST.ARRAY:
             if stype == OST.BLOCK:
                 for x in p:
-                    stk.append(x)
-                    prgm.run(s)
+                    prgm.call(s, x)
                     if stk.pop():
                         stk.append(x)
                         break
@@ -440,6 +487,8 @@ def ost_instructions():
             except ValueError:
                 stk.append(-1)
         elif ptype == OST.NUMBER:
+            if type(a) is int and type(b) is int:
+                allocate(prgm, abs(a).bit_length() * b // 8)
             stk.append(a ** b)
     INSTRUCTIONS['?'] = question
 
@@ -488,23 +537,26 @@ def ost_instructions():
         a, b = stk.popn(2)
         ptype = OS.typeof(OS.byprec([a, b])[0])
 
-        # note: enumerable ^ enumerable does not use set() because
-        # order must be guaranteed
+        # note: enumerable ^ enumerable keeps the order of the operands;
+        # sets are only used for membership
         if ptype == OST.ARRAY:
             a1 = OS.convert(a, OST.ARRAY)
             a2 = OS.convert(b, OST.ARRAY)
-            stk.append([x for x in a1 if x not in a2] +
-                       [x for x in a2 if x not in a1])
+            k1, k2 = keyset(a1), keyset(a2)
+            stk.append([x for x in a1 if frozen(x) not in k2] +
+                       [x for x in a2 if frozen(x) not in k1])
         elif ptype == OST.BLOCK:
             s1 = OS.tostr(a)
             s2 = OS.tostr(b)
-            stk.append(block(''.join([c for c in s1 if c not in s2] +
-                                     [c for c in s2 if c not in s1])))
+            k1, k2 = set(s1), set(s2)
+            stk.append(block(''.join([c for c in s1 if c not in k2] +
+                                     [c for c in s2 if c not in k1])))
         elif ptype == OST.STRING:
             s1 = OS.tostr(a)
             s2 = OS.tostr(b)
-            stk.append(''.join([c for c in s1 if c not in s2] +
-                               [c for c in s2 if c not in s1]))
+            k1, k2 = set(s1), set(s2)
+            stk.append(''.join([c for c in s1 if c not in k2] +
+                               [c for c in s2 if c not in k1]))
         elif ptype == OST.NUMBER:
             stk.append(a ^ b)
     INSTRUCTIONS['^'] = bitxor
@@ -537,26 +589,35 @@ def ost_instructions():
         '''
         all ur base r belong to us
         '''
+        import ost_bigint
         a, b = stk.popn(2)
         at = OS.typeof(a)
         if at == OST.ARRAY:
+            if type(b) is int and (type(a) is numarray or
+                                   all(type(d) is int for d in a)):
+                stk.append(ost_bigint.undigits(a, b))
+                return
             num = 0
             for d in a:
                 num *= b
                 num += d
             stk.append(num)
         elif at == OST.NUMBER:
+            if type(a) is int and a >= 0 and type(b) is int and b >= 2:
+                stk.append(numarray.of(ost_bigint.digits(a, b)))
+                return
             arr = []
             while a:
                 a, val = divmod(a, b)
                 arr.append(val)
-            stk.append(list(reversed(arr)))
+            stk.append(numarray.of(arr[::-1]))
     INSTRUCTIONS['B'] = letter_B
 
     def letter_C(self, stk, prgm):
         '''
         Ceiling for numbers.
         '''
+        import math
         stk.append(math.ceil(stk.pop()))
     INSTRUCTIONS['C'] = letter_C
 
@@ -564,6 +625,7 @@ def ost_instructions():
         '''
         Time since Unix epoch.
         '''
+        import time
         stk.append(time.time())
     INSTRUCTIONS['D'] = letter_D
 
@@ -571,6 +633,7 @@ def ost_instructions():
         '''
         Evaluate as Python code.
         '''
+        import math, random, re, time  # for the code, as they always were
         stk.append(eval(stk.pop()))
     INSTRUCTIONS['E'] = letter_E
 
@@ -581,10 +644,11 @@ def ost_instructions():
         x = stk.pop()
         xt = OS.typeof(x)
         if xt == OST.NUMBER:
+            import math
             stk.append(math.floor(x))
         elif xt == OST.ARRAY:
             for i, _ in enumerate(x):
-                while type(x[i]) is list:
+                while OS.typeof(x[i]) == OST.ARRAY:
                     x[i:i+1] = x[i]
             stk.append(x)
     INSTRUCTIONS['F'] = letter_F
@@ -593,7 +657,8 @@ def ost_instructions():
         '''
         Get a line of input.
         '''
-        stk.append(input())
+        prgm.output.flush()
+        stk.append(prgm.input.readline())
     INSTRUCTIONS['G'] = letter_G
 
     def letter_H(self, stk, prgm):
@@ -615,7 +680,8 @@ def ost_instructions():
         a, b, c = stk.popn(3)
         toRun = b if c else a
         if OS.typeof(toRun) == OST.BLOCK:
-            prgm.run(toRun)
+            prgm.callee = toRun
+            return OS.XSTATE.CALL
         else:
             stk.append(toRun)
     INSTRUCTIONS['I'] = letter_I
@@ -624,10 +690,23 @@ def ost_instructions():
         '''
         Regex match.
         '''
+        import re
         s, pattern = stk.popn(2)
         stk.append(list(map(list, re.findall(pattern, s))))
     INSTRUCTIONS['M'] = letter_M
 
+    def letter_N(self, stk, prgm):
+        '''
+        Read all (remaining) whitespace-separated integers from STDIN, as an
+        array.
+
+            >>> N
+            [1 2 3]
+        '''
+        prgm.output.flush()
+        stk.append(prgm.input.ints())
+    INSTRUCTIONS['N'] = letter_N
+
     def letter_O(self, stk, prgm):
         '''
         Ord for strings; that is, convert to ASCII value. Reverse for integers,
@@ -645,13 +724,14 @@ def ost_instructions():
         '''
         Print.
         '''
-        sys.stdout.write(OS.tostr(stk.pop()))
+        prgm.output.emit(stk.pop())
     INSTRUCTIONS['P'] = letter_P
 
     def letter_Q(self, stk, prgm):
         '''
         Quit the program.
         '''
+        prgm.output.flush()
         return OS.XSTATE.EXIT
     INSTRUCTIONS['Q'] = letter_Q
 
@@ -662,6 +742,7 @@ def ost_instructions():
 
             >>> R
         '''
+        import random
         stk.append(random.random())
     INSTRUCTIONS['R'] = letter_R
 
@@ -669,7 +750,8 @@ def ost_instructions():
         '''
         Read from STDIN.
         '''
-        stk.append(sys.stdin.read())
+        prgm.output.flush()
+        stk.append(prgm.input.read())
     INSTRUCTIONS['S'] = letter_S
 
     def letter_T(self, stk, prgm):
@@ -714,11 +796,11 @@ def ost_instructions():
         '''
         Regex replace.
         '''
+        import re
         s, pattern, repl = stk.popn(3)
         if OS.typeof(repl) == OST.BLOCK:
             def replFunc(m):
-                stk.append(m.group())
-                prgm.run(repl)
+                prgm.call(repl, m.group())
                 return OS.tostr(stk.pop())
             stk.append(re.sub(pattern, replFunc, s))
         else:
@@ -763,8 +845,8 @@ def ost_instructions():
         a, b = stk.popn(2)
         ptype = OS.typeof(OS.byprec([a, b])[0])
 
-        # note: enumerable | enumerable does not use set() because
-        # order must be guaranteed
+        # note: enumerable | enumerable keeps the order of the operands;
+        # uniq only uses a set for membership
         if ptype == OST.ARRAY:
             a1 = OS.convert(a, OST.ARRAY)
             a2 = OS.convert(b, OST.ARRAY)
@@ -798,10 +880,11 @@ def ost_instructions():
         xt = OS.typeof(x)
         if xt == OST.ARRAY:
             stk.extend(x)
-        if xt == OST.BLOCK:
-            prgm.run(x)
-        if xt == OST.STRING:
-            prgm.run(x)
+        if xt == OST.BLOCK or xt == OST.STRING:
+            # the engine runs it, so that deep recursion needs no Python
+            # stack
+            prgm.callee = x
+            return OS.XSTATE.CALL
         if xt == OST.NUMBER:
             stk.append(-x)
     INSTRUCTIONS['~'] = tilde
@@ -827,3 +910,63 @@ def ost_variables():
 OS = ost_stack.Stack
 OST = ost_stack.Stack.TYPES
 block = ost_stack.Block
+numarray = ost_stack.NumArray
+rope = ost_stack.Rope
+
+
+# the dispatch table: a tuple of handlers indexed by code point, with
+# unknowninstr for every character that has no builtin
+BUILTINS = ost_instructions()
+TABLE = ()
+
+# the builtins as they ship, before any register(); ost_optimize only folds
+# and fuses these
+STOCK = dict(BUILTINS)
+
+def build_table():
+    global TABLE
+    size = max(256, max(map(ord, BUILTINS)) + 1)
+    table = [unknowninstr] * size
+    for c, handler in BUILTINS.items():
+        table[ord(c)] = handler
+    TABLE = tuple(table)
+build_table()
+
+def lookup(c):
+    o = ord(c)
+    return TABLE[o] if o < len(TABLE) else unknowninstr
+
+def register(char, arity=None):
+    '''
+    Adds (or replaces) the builtin for a character. Use it as a decorator:
+
+        @ost_instructions.register('J', arity=2)
+        def gcd(a, b):
+            return math.gcd(a, b)
+
+    With an arity, the function is called with that many values popped off
+    the stack (deepest first) and what it returns is pushed, unless it is
+    None; a tuple is pushed one element at a time. Without an arity, it is a
+    raw handler taking (self, stk, prgm) like the builtins above, and may
+    return a state. The table is rebuilt, so programs that are already
+    running keep the builtins they started with.
+    '''
+    def register_inner(fn):
+        handler = fn
+        if arity is not None:
+            def handler(self, stk, prgm):
+                rtn = fn(*stk.popn(arity)) if arity else fn()
+                if type(rtn) is tuple:
+                    stk.extend(rtn)
+                elif rtn is not None:
+                    stk.append(rtn)
+            handler.__doc__ = fn.__doc__
+        BUILTINS[char] = handler
+        build_table()
+        # optimized code was made for the builtins it replaces
+        import ost_optimize, ost_vm
+        ost_optimize.optimized.clear()
+        ost_optimize.bodies.clear()
+        ost_vm.optimized.clear()
+        return fn
+    return register_inner
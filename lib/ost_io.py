@@ -0,0 +1,192 @@
+import io, mmap, os, stat, sys
+
+import ost_stack
+
+
+# how much is read at a time when scanning for whitespace-separated tokens
+CHUNK = 1 << 20
+
+
+class Input:
+    '''
+    Where S, G and N read from: sys.stdin (looked up on first use) or any
+    other text stream. A regular file is memory-mapped, so its lines and
+    tokens are read straight from the page cache instead of being copied
+    into one big string first. S, G and N share one position in the input.
+    '''
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.mm = None
+        self.encoding = 'utf-8'
+        self.opened = False
+
+    def open(self):
+        self.opened = True
+        if self.stream is None:
+            self.stream = sys.stdin
+        try:
+            fd = self.stream.fileno()
+            info = os.fstat(fd)
+        except (AttributeError, OSError, ValueError):
+            return  # not backed by a file (StringIO etc.)
+        if stat.S_ISREG(info.st_mode) and info.st_size:
+            self.mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            self.mm.seek(os.lseek(fd, 0, os.SEEK_CUR))
+            self.encoding = getattr(self.stream, 'encoding', None) or 'utf-8'
+
+    def decode(self, data):
+        text = data.decode(self.encoding)
+        if '\r' in text:  # same newlines as a text stream would give
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text
+
+    def read(self):
+        '''
+        Everything that is left, as one string.
+        '''
+        if not self.opened: self.open()
+        if self.mm is None:
+            return self.stream.read()
+        return self.decode(self.mm.read())
+
+    def readline(self):
+        '''
+        The next line, without its newline; raises EOFError at the end of the
+        input, like input().
+        '''
+        if not self.opened: self.open()
+        line = self.stream.readline() if self.mm is None else \
+            self.decode(self.mm.readline())
+        if not line:
+            raise EOFError('EOF when reading a line')
+        return line[:-1] if line[-1] == '\n' else line
+
+    def lines(self):
+        '''
+        The remaining lines, read one at a time.
+        '''
+        while True:
+            try:
+                yield self.readline()
+            except EOFError:
+                return
+
+    def chunks(self):
+        if not self.opened: self.open()
+        read = self.stream.read if self.mm is None else self.mm.read
+        while True:
+            chunk = read(CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+    # the remaining whitespace-separated words, a chunk's worth at a time
+    def wordlists(self):
+        partial = None
+        for chunk in self.chunks():
+            if partial:
+                chunk = partial + chunk
+            words = chunk.split()
+            # the last word may continue in the next chunk
+            partial = words.pop() if words and not chunk[-1:].isspace() \
+                else None
+            yield words
+        if partial:
+            yield [partial]
+
+    def tokens(self):
+        '''
+        The remaining whitespace-separated tokens, read a chunk at a time.
+        '''
+        for words in self.wordlists():
+            yield from map(self.decode, words) if self.mm else words
+
+    def ints(self):
+        '''
+        All remaining whitespace-separated integers, parsed in one pass
+        straight into a NumArray (or a list, if some do not fit).
+        '''
+        nums = numarray('q')
+        for words in self.wordlists():
+            vals = list(map(int, words))
+            if type(nums) is numarray:
+                try:
+                    vals = numarray('q', vals)
+                except OverflowError:
+                    nums = nums.tolist()
+            nums.extend(vals)
+        return nums
+
+
+class Output:
+    '''
+    Where P and the final stack are written: sys.stdout (looked up on first
+    use), a text stream, a binary stream (written as UTF-8) or any callable
+    that takes a str. Output is collected until `bufsize` characters are
+    waiting, and written in one go then and on flush(), which the
+    interpreter does when a run returns (or fails), on Q and before
+    reading input.
+    '''
+
+    def __init__(self, writer=None, bufsize=1 << 16):
+        self.writer = writer
+        self.bufsize = bufsize
+        self.parts = []
+        self.size = 0
+        self.target = self.sink = None
+
+    def open(self):
+        writer = self.target = \
+            self.writer if self.writer is not None else sys.stdout
+        if isinstance(writer, (io.RawIOBase, io.BufferedIOBase)):
+            self.sink = lambda s: writer.write(s.encode('utf-8'))
+        elif hasattr(writer, 'write'):
+            self.sink = writer.write
+        else:
+            self.sink = writer
+
+    def write(self, s):
+        self.parts.append(s)
+        self.size += len(s)
+        if self.size >= self.bufsize:
+            self.flush()
+
+    def emit(self, x):
+        '''
+        Write x as it would be converted to a string, without building the
+        whole string of a big array first.
+        '''
+        if OS.typeof(x) != OST.ARRAY:
+            self.write(OS.tostr(x))
+            return
+        for i in range(0, len(x), EMIT_ITEMS):
+            part = x[i:i+EMIT_ITEMS]
+            if i:
+                self.write(' ')
+            if any(OS.typeof(item) == OST.ARRAY for item in part):
+                for j, item in enumerate(part):
+                    if j:
+                        self.write(' ')
+                    self.emit(item)
+            else:
+                self.write(' '.join(map(OS.tostr, part)))
+
+    def flush(self):
+        if self.sink is None: self.open()
+        if self.parts:
+            data = ''.join(self.parts)
+            self.parts = []
+            self.size = 0
+            self.sink(data)
+        if hasattr(self.target, 'flush'):
+            self.target.flush()
+
+
+# array elements converted per write by Output#emit
+EMIT_ITEMS = 1024
+
+# just for convenience
+OS = ost_stack.Stack
+OST = ost_stack.Stack.TYPES
+numarray = ost_stack.NumArray
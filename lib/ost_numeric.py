@@ -0,0 +1,192 @@
+import operator
+
+import ost_cache, ost_stack, ost_tokenizer
+
+
+# NumPy is optional; it is imported the first time a big enough numeric
+# array is mapped or folded, and set to False if it is not installed
+numpy = None
+
+# arrays shorter than this are not worth converting
+THRESHOLD = 256
+# every intermediate value must stay within this, so int64 never overflows
+LIMIT = 2 ** 62
+
+
+def available():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as np
+        except ImportError:
+            np = False
+        numpy = np
+    return numpy is not False
+
+
+# arithmetic a block may use to be vectorized: (function, bound), where the
+# bound function gives an upper limit on the absolute value of the result
+# from the limits of the operands
+BINARY = {
+    '+': (operator.add, lambda x, y: x + y),
+    '-': (operator.sub, lambda x, y: x + y),
+    '*': (operator.mul, lambda x, y: x * y),
+    '&': (operator.and_, lambda x, y: 2 * max(x, y)),
+    '|': (operator.or_, lambda x, y: 2 * max(x, y)),
+    '^': (operator.xor, lambda x, y: 2 * max(x, y)),
+    '<': (lambda a, b: (a < b) * 1, lambda x, y: 1),
+    '=': (lambda a, b: (a == b) * 1, lambda x, y: 1),
+    '>': (lambda a, b: (a > b) * 1, lambda x, y: 1),
+}
+UNARY = {
+    '(': (lambda x: x - 1, lambda x: x + 1),
+    ')': (lambda x: x + 1, lambda x: x + 1),
+    '~': (operator.neg, lambda x: x),
+    'A': (abs, lambda x: x),
+}
+# these raise on a zero divisor, so vectors containing zero are left alone
+DIVISION = '%V'
+SHUFFLE = '.\\;'
+FOLDS = {'+': 'add', '-': 'subtract', '*': 'multiply',
+         '&': 'bitwise_and', '|': 'bitwise_or', '^': 'bitwise_xor'}
+
+
+def analyze(code):
+    '''
+    The list of operations (characters, and ints for number literals) in a
+    block that only does integer arithmetic, or None if it does anything
+    else.
+    '''
+    ops = []
+    for kind, val in ost_tokenizer.tokenize(code):
+        if kind == TOK.NUMBER:
+            ops.append(val)
+        elif kind == TOK.INSTR and (val in BINARY or val in UNARY or
+                                    val in DIVISION or val in SHUFFLE):
+            ops.append(val)
+        elif kind != TOK.INSTR or val not in ' \n':
+            return None
+    return ops
+analyzed = ost_cache.LRUCache(analyze, maxsize=256)
+
+
+# the ops of blk if prgm may vectorize it right now: none of its characters
+# may have been assigned to
+def vectorizable(prgm, blk):
+    if not prgm.vectorize:
+        return None
+    ops = analyzed(blk)
+    if ops is None:
+        return None
+    if any(prgm.variables.get(c) is not None for c in set(blk)):
+        return None
+    if prgm.digitvars and any(type(op) is int for op in ops):
+        return None
+    return ops
+
+
+# the array as an int64 vector and the largest absolute value in it, or
+# None if it is too short or not made of (small enough) integers
+def vector(arr):
+    if len(arr) < THRESHOLD:
+        return None
+    packed = type(arr) is numarray
+    if not packed and not all(type(x) is int for x in arr):
+        return None
+    bound = max(-min(arr), max(arr))
+    if bound > LIMIT or not available():
+        return None
+    if packed:
+        return numpy.frombuffer(arr, dtype=numpy.int64), bound
+    return numpy.array(arr, dtype=numpy.int64), bound
+
+
+def map_block(prgm, arr, blk):
+    '''
+    Run blk on every element of arr at once, as `%` would one at a time.
+    Returns the mapped array, or None if the caller has to do it the slow
+    way.
+    '''
+    ops = vectorizable(prgm, blk)
+    if ops is None:
+        return None
+    vec = vector(arr)
+    if vec is None:
+        return None
+
+    # entries are (value, bound); values are vectors or plain ints
+    stack = [vec]
+    for op in ops:
+        if type(op) is int:
+            stack.append((op, op))
+        elif op in SHUFFLE:
+            if not stack:
+                return None
+            if op == '.':
+                stack.append(stack[-1])
+            elif op == ';':
+                stack.pop()
+            elif len(stack) < 2:
+                return None
+            else:
+                stack[-2:] = stack[:-3:-1]
+        elif op in UNARY:
+            if not stack:
+                return None
+            (x, bx), (fn, bound) = stack.pop(), UNARY[op]
+            stack.append((fn(x), bound(bx)))
+        else:
+            if len(stack) < 2:
+                return None
+            (a, ba), (b, bb) = stack[-2:]
+            del stack[-2:]
+            if op in DIVISION:
+                if (b == 0) if type(b) is int else (b == 0).any():
+                    return None
+                stack.append((a // b if op == 'V' else a % b, max(ba, bb)))
+                if op == 'V':
+                    stack.append((a % b, bb))
+            else:
+                fn, bound = BINARY[op]
+                stack.append((fn(a, b), bound(ba, bb)))
+        if stack and stack[-1][1] > LIMIT:
+            return None
+
+    n = len(arr)
+    columns = [numpy.full(n, x, dtype=numpy.int64) if type(x) is int
+               else numpy.asarray(x, dtype=numpy.int64) for x, _ in stack]
+    mapped = numarray('q')
+    if columns:
+        mapped.frombytes(numpy.stack(columns, axis=1).tobytes())
+    return mapped
+
+
+def fold_block(prgm, arr, blk):
+    '''
+    Fold arr with a block that is a single arithmetic operation, as `*`
+    would one element at a time. Returns the result, or None if the caller
+    has to do it the slow way.
+    '''
+    ops = vectorizable(prgm, blk)
+    if ops is None or len(ops) != 1 or ops[0] not in FOLDS:
+        return None
+    vec = vector(arr)
+    if vec is None:
+        return None
+
+    x, bound = vec
+    op = ops[0]
+    if op in '+-':
+        safe = bound * len(arr) <= LIMIT
+    elif op == '*':
+        safe = numpy.log2(numpy.abs(x) + 1.0).sum() < 60
+    else:
+        safe = True
+    if not safe:
+        return None
+    return int(getattr(numpy, FOLDS[op]).reduce(x))
+
+
+# just for convenience
+numarray = ost_stack.NumArray
+TOK = ost_tokenizer.TOKENS
@@ -0,0 +1,367 @@
+import operator
+
+import ost_budget, ost_cache, ost_instructions, ost_stack, ost_tokenizer
+
+
+# builtins that are folded when all their operands are constants, with how
+# many operands they take; the others read input, write output, look deeper
+# into the stack or are random
+FOLDABLE = {
+    '!': 1, '\'': 1, '(': 1, ')': 1, ',': 1, '.': 1, ';': 1, 'A': 1,
+    'C': 1, 'F': 1, 'H': 1, 'O': 1, 'T': 1, '~': 1,
+    '%': 2, '&': 2, '*': 2, '+': 2, '-': 2, '/': 2, '<': 2, '=': 2,
+    '>': 2, '?': 2, '\\': 2, '^': 2, '|': 2, 'V': 2,
+    '#': 3, 'Y': 3,
+}
+
+# what a folded constant may be: a value that cannot change in place, as
+# the same one is pushed every time the code runs, and not too big
+CONSTANTS = (int, float, str, ost_stack.Block)
+MAX_CONSTANT = 1024
+
+# builtins that run blocks or strings for some operands; those may assign
+# to anything, so optimized code checks again after them whether it may go
+# on (see Optimized)
+CALLERS = set('$%*,/(?)EX')
+
+# builtins that have the engine run a block for them (see
+# ost_stack.XSTATE.CALL); only inlined or folded, never fused
+FRAMED = set('~I')
+
+# builtins that return a state to the engine, or that only run when the
+# tokenizer did not take them; never fused
+STATEFUL = set('"0123456789:[]_`{}Q')
+
+WHITESPACE = ' \n'
+
+# the most frequent pairs of tokens (see bench/pairs.py) are a number
+# followed by arithmetic or a comparison, and . followed by * or +; with a
+# number on top of the stack they take one step. Small numbers only, so
+# that mixing them with floats never overflows
+NUMBER_OPS = {
+    '+': operator.add, '-': operator.sub, '*': operator.mul,
+    '%': operator.mod, '<': lambda a, b: int(a < b),
+    '=': lambda a, b: int(a == b), '>': lambda a, b: int(a > b),
+}
+DUP_OPS = {'+': operator.add, '*': operator.mul}
+SMALL = 1 << 31
+
+# ( and ) on a number, as in counting loops
+UNARY_OPS = {'(': lambda a: a - 1, ')': lambda a: a + 1}
+
+
+class Optimized:
+    '''
+    Straight-line code that does what a run of tokens does, with fewer
+    dispatches: constants folded, whitespace dropped, frequent pairs fused
+    and literal blocks that are run right away inlined. `ops` are
+    (handler, value) pairs, run as handler(value, stack, program);
+    `original` are the tokens, which the engines run instead once one of
+    the builtins the code relies on has been assigned to (see
+    Ostrich#shadowed); `weight` is how many instructions they count for in
+    a budget.
+
+    Ops that may run other code (see CALLERS) end a segment: `ops` and
+    `weight` are the first, `more` the others as (ops, the tokens from
+    there on, weight). A segment only runs if nothing has been assigned to
+    a builtin and the budget has room for all of it; otherwise the rest of
+    the tokens run instead, each counted on its own.
+    '''
+    __slots__ = ('ops', 'more', 'original', 'weight')
+
+    def __init__(self, ops, original, weight, more=()):
+        self.ops = ops
+        self.more = more
+        self.original = original
+        self.weight = weight
+
+    def run(self, prgm):
+        stk = prgm.stack
+        for handler, val in self.ops:
+            handler(val, stk, prgm)
+        for ops, rest, weight in self.more:
+            if prgm.shadowed or prgm.budget is not None and \
+                    not prgm.budget.charge(prgm, weight):
+                prgm.execute(rest)
+                return
+            for handler, val in ops:
+                handler(val, stk, prgm)
+
+    def __repr__(self):
+        return 'Optimized(%r)' % self.ops
+
+
+# what ops do
+def push(val, stk, prgm):
+    stk.append(val)
+
+def extend(vals, stk, prgm):
+    stk.extend(vals)
+
+def assign(name, stk, prgm):
+    prgm.variables[name] = stk[-1]
+
+# {...}:f; and the like: push, assign, pop
+def define(val, stk, prgm):
+    name, value = val
+    prgm.variables[name] = value
+
+def number_op(val, stk, prgm):
+    n, fn, instr, handler = val
+    if stk and (type(stk[-1]) is int or type(stk[-1]) is float):
+        stk[-1] = fn(stk[-1], n)
+    else:
+        stk.append(n)
+        handler(instr, stk, prgm)
+
+def dup_op(val, stk, prgm):
+    fn, instr, dup, handler = val
+    if stk and (type(stk[-1]) is int or type(stk[-1]) is float):
+        stk[-1] = fn(stk[-1], stk[-1])
+    else:
+        dup('.', stk, prgm)
+        handler(instr, stk, prgm)
+
+def binary_op(val, stk, prgm):
+    fn, instr, handler = val
+    if len(stk) > 1:
+        a, b = stk[-2], stk[-1]
+        if (type(a) is int or type(a) is float) and \
+                (type(b) is int or type(b) is float) and (b or instr != '%'):
+            del stk[-1]
+            stk[-1] = fn(a, b)
+            return
+    handler(instr, stk, prgm)
+
+def unary_op(val, stk, prgm):
+    fn, instr, handler = val
+    if stk and (type(stk[-1]) is int or type(stk[-1]) is float):
+        stk[-1] = fn(stk[-1])
+    else:
+        handler(instr, stk, prgm)
+
+
+class Unfoldable(Exception):
+    pass
+
+
+class Folding:
+    '''
+    What a builtin sees as the program while it is folded. It has no
+    input, output or variables, and running code or building anything big
+    (see ost_instructions.allocate) stops the fold.
+    '''
+    state = None
+
+    def __init__(self):
+        self.budget = self
+
+    def call(self, code, *args):
+        raise Unfoldable()
+
+    def allocate(self, prgm, nbytes):
+        if nbytes > MAX_CONSTANT:
+            raise Unfoldable()
+
+
+class Run:
+    '''
+    Straight-line code being built from a run of tokens.
+    '''
+
+    def __init__(self):
+        self.ops = []
+        self.original = []
+        self.weights = []  # how many instructions each token counts for
+        self.weight = 0
+        self.constants = 0  # how many of the last ops are pushes
+        # (op index, token index) after every op that may run other code
+        self.ends = []
+
+    def push(self, token):
+        self.add(token)
+        self.ops.append((push, token[1]))
+        self.constants += 1
+
+    def assign(self, token):
+        self.add(token)
+        self.ops.append((assign, token[1]))
+        self.constants = 0
+
+    def add(self, token, weight=1):
+        self.original.append(token)
+        self.weights.append(weight)
+        self.weight += weight
+
+    # a builtin; False if it cannot be part of the run
+    def call(self, token, handler):
+        instr = token[1]
+        if instr in WHITESPACE:
+            self.add(token)
+            return True
+        last = self.ops[-1] if self.ops else (None, None)
+
+        if instr == '~' and self.constants and \
+                type(last[1]) is ost_stack.Block:
+            body = straight(last[1])
+            if body is not None and all(op == len(body.ops)
+                                        for op, _ in body.ends):
+                # as ~ would call it: one more instruction for the call
+                self.add(token, body.weight + 2)
+                self.ops[-1:] = body.ops
+                self.constants = 0
+                if body.ends:
+                    self.ends.append((len(self.ops), len(self.original)))
+                return True
+        if self.fold(instr, handler):
+            self.add(token)
+            return True
+        if instr in FRAMED:
+            return False
+        self.add(token)
+        if instr in NUMBER_OPS and self.constants and \
+                type(last[1]) is int and -SMALL < last[1] < SMALL and \
+                (instr != '%' or last[1]):
+            self.ops[-1] = (number_op, (last[1], NUMBER_OPS[instr], instr,
+                                        handler))
+        elif instr in DUP_OPS and last == (STOCK['.'], '.'):
+            self.ops[-1] = (dup_op, (DUP_OPS[instr], instr, last[0],
+                                     handler))
+        elif instr == ';' and len(self.ops) > 1 and self.constants == 0 \
+                and self.ops[-1][0] is assign and self.ops[-2][0] is push:
+            self.ops[-2:] = [(define, (last[1], self.ops[-2][1]))]
+        elif instr in NUMBER_OPS:
+            self.ops.append((binary_op, (NUMBER_OPS[instr], instr, handler)))
+        elif instr in UNARY_OPS:
+            self.ops.append((unary_op, (UNARY_OPS[instr], instr, handler)))
+        else:
+            self.ops.append((handler, instr))
+        self.constants = 0
+        if instr in CALLERS:
+            self.ends.append((len(self.ops), len(self.original)))
+        return True
+
+    # run a builtin on the constants it takes, if there are enough of them
+    # and it gives constants back
+    def fold(self, instr, handler):
+        arity = FOLDABLE.get(instr)
+        if arity is None or arity > self.constants:
+            return False
+        stk = OS(val for _, val in self.ops[-arity:])
+        try:
+            if handler(instr, stk, FOLDING) is not None:
+                return False
+        except (Unfoldable, ArithmeticError, AttributeError, LookupError,
+                TypeError, ValueError):
+            return False
+        if not all(type(x) in CONSTANTS and
+                   ost_budget.size(x) <= MAX_CONSTANT for x in stk):
+            return False
+        self.ops[-arity:] = [(push, x) for x in stk]
+        self.constants += len(stk) - arity
+        return True
+
+    # the token that runs this code
+    def finish(self):
+        if len(self.original) == 1:
+            return self.original[0]
+        return (TOK.OPTIMIZED, self.optimized())
+
+    # this code as an Optimized, split into segments
+    def optimized(self):
+        bounds = [(0, 0)] + [end for end in self.ends
+                             if end[0] < len(self.ops)] + \
+            [(len(self.ops), len(self.original))]
+        segments = [(merged(self.ops[op:next_op]), self.original[pos:],
+                     sum(self.weights[pos:next_pos]))
+                    for (op, pos), (next_op, next_pos)
+                    in zip(bounds, bounds[1:])]
+        ops, _, weight = segments[0]
+        return Optimized(ops, self.original, weight, segments[1:])
+
+
+# ops with pushes in a row merged
+def merged(ops):
+    result = []
+    for handler, val in ops:
+        if handler is push and result and result[-1][0] is push:
+            result[-1] = (extend, (result[-1][1], val))
+        elif handler is push and result and result[-1][0] is extend:
+            result[-1] = (extend, result[-1][1] + (val,))
+        else:
+            result.append((handler, val))
+    return result
+
+
+# the handler for a builtin that may be fused, or None
+def fusible(instr):
+    handler = STOCK.get(instr)
+    if handler is None or instr in STATEFUL or \
+            ost_instructions.lookup(instr) is not handler:
+        return None
+    return handler
+
+
+def build(tokens):
+    '''
+    Runs (of straight-line code) and the tokens between them.
+    '''
+    items, run = [], Run()
+    for token in tokens:
+        kind, val = token
+        if kind == TOK.LITERAL or kind == TOK.NUMBER:
+            run.push(token)
+            continue
+        if kind == TOK.INSTR:
+            handler = fusible(val)
+            if handler is not None and run.call(token, handler):
+                continue
+        elif kind == TOK.ASSIGN and val not in STOCK:
+            run.assign(token)
+            continue
+        # variables, arrays, Q and assignments to builtins run as they are
+        if run.original:
+            items.append(run)
+            run = Run()
+        items.append(token)
+    if run.original:
+        items.append(run)
+    return items
+
+
+# the body of a literal block as one run, if it is straight-line code
+def straight(code):
+    items = build(ost_cache.parsed(code))
+    if not items:
+        return Run()
+    if len(items) == 1 and type(items[0]) is Run:
+        return items[0]
+    return None
+
+
+def optimize(tokens):
+    '''
+    The tokens with every run of straight-line code replaced by one
+    OPTIMIZED token (see Optimized).
+    '''
+    return [item.finish() if type(item) is Run else item
+            for item in build(tokens)]
+
+
+# a block as one Optimized, or None if it is not all straight-line code
+def body(code):
+    run = straight(code)
+    return None if run is None else run.optimized()
+
+
+# optimized tokens for every program and block run by Ostrich#interpret
+optimized = ost_cache.LRUCache(lambda code: optimize(ost_cache.parsed(code)))
+
+# bodies of the blocks loops run over and over (see Ostrich#loop)
+bodies = ost_cache.LRUCache(body)
+
+# just for convenience
+OS = ost_stack.Stack
+TOK = ost_tokenizer.TOKENS
+STOCK = ost_instructions.STOCK
+FOLDING = Folding()
@@ -0,0 +1,129 @@
+from collections import Counter
+import time
+
+import ost_stack
+
+
+class Profiler:
+    '''
+    Counts every call of every builtin, with its total time (including the
+    blocks it runs), its self time (excluding them) and the types of the
+    top two stack elements it was called with. Only used when profiling is
+    switched on; see Ostrich(profile=True) and --profile.
+    '''
+
+    def __init__(self):
+        # instruction -> [calls, total time, self time, Counter of operands]
+        self.stats = {}
+        # time spent in nested builtins, one entry per builtin running
+        self.nested = [0.0]
+
+    def call(self, handler, instr, stk, prgm):
+        operands = ' '.join(TYPENAMES.get(OS.typeof(x), '?')
+                            for x in stk[-2:])
+        self.nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            return handler(instr, stk, prgm)
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = self.nested.pop()
+            self.nested[-1] += elapsed
+            entry = self.stats.get(instr)
+            if entry is None:
+                entry = self.stats[instr] = [0, 0.0, 0.0, Counter()]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += elapsed - inner
+            entry[3][operands] += 1
+
+    def clear(self):
+        self.stats.clear()
+
+    def as_dict(self):
+        return {instr: {'calls': calls, 'total': total, 'self': own,
+                        'operands': dict(operands)}
+                for instr, (calls, total, own, operands)
+                in self.stats.items()}
+
+    def report(self):
+        '''
+        A table of all builtins that were called, most self time first.
+        '''
+        lines = ['%-6s %10s %10s %10s  %s' % ('instr', 'calls', 'total',
+                                               'self', 'operands')]
+        for instr, (calls, total, own, operands) in sorted(
+                self.stats.items(), key=lambda kv: -kv[1][2]):
+            lines.append('%-6s %10d %9.4fs %9.4fs  %s' % (
+                repr(instr)[1:-1], calls, total, own,
+                ', '.join('%s %d' % (types or '-', n)
+                          for types, n in operands.most_common())))
+        return '\n'.join(lines)
+
+
+class Tracer:
+    '''
+    Follows the logical Ostrich call stack: the program, the blocks run by
+    builtins (named by their source) and the variable-bound blocks called
+    by name, each with the offset of the token it is at. Every executed
+    token is counted against the whole stack, so collapsed() can be fed to
+    flame graph tools. Only used when tracing is switched on; see
+    Ostrich(trace=True) and --flame.
+    '''
+
+    def __init__(self):
+        self.counts = Counter()
+        # one [name, first token, offset] per block being run, outermost
+        # first; first moves when the engine splices tokens in front
+        self.runs = []
+
+    # a block run by a builtin (or the program itself) starts
+    def enter(self, code):
+        name = label(code) if self.runs else 'main'
+        self.runs.append([name, 0, 0])
+
+    # the block in variable `name` is called
+    def call(self, name):
+        self.runs.append([escape(name), 0, 0])
+
+    def leave(self):
+        self.runs.pop()
+
+    # the engine put `length` tokens in front of its tokens from pos on
+    def splice(self, length, pos):
+        self.runs[-1][1] += length - pos
+
+    # the engine is about to run the token at pos
+    def tick(self, pos):
+        run = self.runs[-1]
+        run[2] = pos - run[1]
+        self.counts[';'.join('%s@%d' % (name, offset)
+                             for name, _, offset in self.runs)] += 1
+
+    def clear(self):
+        self.counts.clear()
+
+    def collapsed(self):
+        '''
+        One `frame;frame;... count` line per distinct stack.
+        '''
+        return ''.join('%s %d\n' % kv for kv in sorted(self.counts.items()))
+
+
+# frame names must not contain the ; separator or newlines
+def escape(name):
+    return name.replace('\\', '\\\\').replace(';', '\\x3b') \
+        .replace('\n', '\\n')
+
+# a block or string as a frame name, shortened
+def label(code):
+    name = OS.inspect(code)
+    if len(name) > 32:
+        name = name[:28] + '...' + name[-1]
+    return escape(name)
+
+
+# just for convenience
+OS = ost_stack.Stack
+OST = ost_stack.Stack.TYPES
+TYPENAMES = {v: k for k, v in vars(OST).items() if not k.startswith('_')}
@@ -3,6 +3,8 @@ import sys       # sys.exit()
 from collections import defaultdict
 import traceback
 
+import ost_cache, ost_vm
+
 
 repl_settings = {
     'autoclear': False,
@@ -23,9 +25,11 @@ def ost_repl(program):
             rtn = COMMANDS[name](' '.join(args))
         else:
             try:
-                rtn = program.run(code)
+                program.call(code)
+                rtn = program.render()
             except Exception as e:
                 rtn = 'Internal python error:\n' + traceback.format_exc()[:-1]
+            program.output.flush()
         # P
         print(rtn)
         # L
@@ -82,3 +86,12 @@ def prompt(args):
         return 'The prompt is currently `%s\'. To change it, type \\\\prompt \
 [PROMPT].' % repl_settings['prompt']
 COMMANDS['prompt'] = prompt
+
+def cache(args):
+    '''Shows hit/miss/eviction counters of the parsed and compiled code \
+caches.'''
+    return '\n'.join('%s: %s' % (name, ', '.join('%s %d' % kv for kv in
+                                                  c.stats().items()))
+                     for name, c in [('parsed', ost_cache.parsed),
+                                     ('compiled', ost_vm.compiled)])
+COMMANDS['cache'] = cache
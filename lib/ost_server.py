@@ -0,0 +1,92 @@
+import json, os, signal, socket, stat, sys
+
+import ost_batch
+
+
+def serve(path, interpreter, options={}, workers=None):
+    '''
+    Serve programs on a Unix socket at path until SIGTERM or SIGINT. The
+    protocol is the one of --batch: a client sends jobs as lines of JSON
+    and gets one line of JSON back for each, on the same connection (see
+    ost_batch.run_job). The modules, instruction table and caches are
+    warmed up once, then `workers` processes (default: one per CPU) are
+    forked that each handle one connection at a time; a worker that dies
+    is replaced.
+    '''
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)  # left behind by a server that was killed
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(128)
+    interpreter(**options).run('1{.}%')
+
+    children = set()
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sock.close()
+        os.unlink(path)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers or os.cpu_count()):
+        children.add(fork(sock, interpreter, options))
+    while True:
+        pid, _ = os.wait()
+        if pid in children:
+            children.remove(pid)
+            children.add(fork(sock, interpreter, options))
+
+
+def fork(sock, interpreter, options):
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+        while True:
+            conn, _ = sock.accept()
+            with conn:
+                handle(conn, interpreter, options)
+    finally:
+        os._exit(1)
+
+
+# one text stream for reading and one for writing: a stream that does both
+# loses what it read ahead whenever it is written to
+def handle(conn, interpreter, options):
+    rfile = conn.makefile('r', encoding='utf-8')
+    wfile = conn.makefile('w', encoding='utf-8')
+    try:
+        for line in rfile:
+            if line.strip():
+                result = ost_batch.run_job(line, interpreter, options)
+                wfile.write(json.dumps(result) + '\n')
+                wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # the client went away
+    finally:
+        rfile.close()
+        try:
+            wfile.close()
+        except OSError:
+            pass
+
+
+def request(path, source, stdin='', **job):
+    '''
+    Run source on the server at path and return the result; job may also
+    give a time_limit and an id.
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps(dict(job, source=source, stdin=stdin)) +
+                      '\n').encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as rfile:
+            return json.loads(rfile.readline())
@@ -1,3 +1,6 @@
+import array
+
+
 # utility methods
 def Enum(**enums): return type('Enum', (), enums)
 
@@ -5,17 +8,18 @@ def Enum(**enums): return type('Enum', (), enums)
 class Stack(list):
     # all Ostrich types; also used for state management
     TYPES = Enum(NUMBER=0, STRING=1, BLOCK=2, ARRAY=3)
-    # extra states (used for :, etc.)
+    # extra states (used for :, etc.); CALL asks the engine to run the block
+    # in Ostrich#callee
     XSTATE = Enum(ASSIGN='_XASGN', EXIT='_XEXIT', CHAR='_XCHAR',
-        CHARBLOCK = '_XCHBK')
+        CHARBLOCK = '_XCHBK', CALL='_XCALL')
 
     def typeof(x):
         xt = type(x)
-        if xt is list:
+        if xt is list or xt is numarray:
             return OST.ARRAY
         if xt is block:
             return OST.BLOCK
-        if xt is str:
+        if xt is str or xt is rope:
             return OST.STRING
         if xt is int or xt is float:
             return OST.NUMBER
@@ -32,9 +36,18 @@ class Stack(list):
             if from_type == OST.ARRAY:
                 return ' '.join(map(lambda item: OS.convert(item, to_type), x))
             if from_type in [OST.NUMBER, OST.STRING, OST.BLOCK]:
-                return str(x)
+                try:
+                    return str(x)
+                except ValueError:
+                    # too many digits for Python to convert by itself
+                    import ost_bigint
+                    return ost_bigint.decimal(x)
         if to_type == OST.NUMBER:
-            return int(OS.tostr(x))
+            try:
+                return int(OS.tostr(x))
+            except ValueError:
+                import ost_bigint
+                return ost_bigint.parse(OS.tostr(x))
 
     # for convenience
     def tostr(x):
@@ -49,13 +62,41 @@ class Stack(list):
         if xt == OST.STRING:
             return '`%s`' % x
         if xt == OST.NUMBER:
-            return ('%d' if type(x) is int else '%f') % x
+            try:
+                return ('%d' if type(x) is int else '%f') % x
+            except ValueError:
+                import ost_bigint
+                return ost_bigint.decimal(x)
+
+    # arrays as plain lists and ropes as strs, all the way down
+    def native(x):
+        if type(x) is numarray:
+            return x.tolist()
+        if type(x) is list:
+            return list(map(OS.native, x))
+        if type(x) is rope:
+            return str(x)
+        return x
+
+    # a rope as a str, anything else as it is
+    def flat(x):
+        return str(x) if type(x) is rope else x
+
+    # ropes only live on the stack (and in variables); whatever is popped is
+    # flattened, unless the caller knows how to deal with ropes
+    def pop(self, i=-1):
+        x = list.pop(self, i)
+        return str(x) if type(x) is rope else x
 
     # pop n elements
-    def popn(self, n):
+    def popn(self, n, flatten=True):
         xs = self[-n:]
         del self[-n:]
-        return xs
+        return list(map(OS.flat, xs)) if flatten else xs
+
+    # pop everything from index i up
+    def popfrom(self, i):
+        return self.popn(len(self) - i) if len(self) > i else []
 
     # pop by precedence: take last n elements, order as specified in TYPES
     def pprec(self, n):
@@ -74,7 +115,118 @@ class Stack(list):
 class Block(str): pass
 
 
+class NumArray(array.array):
+    '''
+    An array of machine-sized ints, stored in 8 bytes per element instead
+    of a list of boxed ints. It is an ordinary OST.ARRAY: it compares equal
+    to the list with the same items, and anything that would put something
+    other than such an int into it gives a plain list instead.
+    '''
+
+    # NumArray.of(xs) is xs as a NumArray if it can be one, else as a list
+    @classmethod
+    def of(cls, xs):
+        if all(type(x) is int for x in xs):
+            try:
+                return cls('q', xs)
+            except OverflowError:
+                pass
+        return list(xs)
+
+    def __getitem__(self, i):
+        x = array.array.__getitem__(self, i)
+        return numarray('q', x) if type(i) is slice else x
+
+    def __add__(self, other):
+        if type(other) is numarray:
+            return numarray('q', array.array.__add__(self, other))
+        if type(other) is list:
+            return numarray.of(self.tolist() + other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if type(other) is list:
+            return numarray.of(other + self.tolist())
+        return NotImplemented
+
+    # never in place, so a NumArray can turn into a list
+    def __iadd__(self, other):
+        return self + other
+
+    def __mul__(self, n):
+        return numarray('q', array.array.__mul__(self, n))
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return 'NumArray(%r)' % self.tolist()
+
+    # compare like lists, with lists and other NumArrays
+    def compare(op):
+        def compare_inner(self, other):
+            if type(other) is list or type(other) is numarray:
+                return op(self.tolist(), list(other))
+            return NotImplemented
+        return compare_inner
+    __eq__ = compare(list.__eq__)
+    __ne__ = compare(list.__ne__)
+    __lt__ = compare(list.__lt__)
+    __le__ = compare(list.__le__)
+    __gt__ = compare(list.__gt__)
+    __ge__ = compare(list.__ge__)
+    __hash__ = None
+    del compare
+
+
+class Rope:
+    '''
+    A string built by repeated appending. It is an OST.STRING, but keeps its
+    pieces in a list and only joins them (once) when a contiguous str is
+    needed: when it is popped, printed or inspected. Ropes that were
+    appended to earlier share the list of pieces, and each sees only its
+    first `count` of them.
+    '''
+    __slots__ = ('parts', 'count', 'length')
+
+    # strings shorter than this are just copied
+    MIN_LENGTH = 256
+
+    def __init__(self, parts, count, length):
+        self.parts = parts
+        self.count = count
+        self.length = length
+
+    # a + s for a string a and a str s, as a rope if it is long enough
+    def concat(a, s):
+        if type(a) is rope:
+            return a + s
+        joined = a + s
+        if len(joined) < rope.MIN_LENGTH:
+            return joined
+        return rope([joined], 1, len(joined))
+
+    def __add__(self, s):
+        parts = self.parts
+        if len(parts) != self.count:
+            parts = parts[:self.count]  # another rope was appended to
+        parts.append(s)
+        return rope(parts, self.count + 1, self.length + len(s))
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        if self.count > 1:
+            self.parts = [''.join(self.parts[:self.count])]
+            self.count = 1
+        return self.parts[0]
+
+    def __repr__(self):
+        return 'Rope(%r)' % str(self)
+
+
 # just for convenience
 OS = Stack
 OST = Stack.TYPES
 block = Block
+numarray = NumArray
+rope = Rope
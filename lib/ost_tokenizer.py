@@ -0,0 +1,95 @@
+import ost_stack
+
+
+# every token is a (kind, value) tuple
+#   INSTR   value is the instruction (or variable) character
+#   LITERAL value is pushed as-is (strings, "x, blocks, _x)
+#   NUMBER  value is the int built from a run of digits
+#   ASSIGN  value is the variable character following the :
+# and, made by ost_optimize from runs of the others,
+#   OPTIMIZED value is an ost_optimize.Optimized
+TOKENS = ost_stack.Enum(INSTR=0, LITERAL=1, NUMBER=2, ASSIGN=3, OPTIMIZED=4)
+
+DIGITS = '0123456789'
+
+
+def tokenize(code):
+    '''
+    Split Ostrich source into a list of tokens, in a single pass.
+
+    Block bodies are kept as text (only braces are counted inside a block,
+    exactly like the old character-walking parser) and are tokenized on
+    their own when they are run. Unclosed strings and blocks extend to the
+    end of the code; a trailing `"`, `_` or `:` is dropped.
+    '''
+    tokens = []
+    append = tokens.append
+    i, n = 0, len(code)
+
+    while i < n:
+        c = code[i]
+
+        if c in DIGITS:
+            end = i + 1
+            while end < n and code[end] in DIGITS:
+                end += 1
+            try:
+                append((TOKENS.NUMBER, int(code[i:end])))
+            except ValueError:
+                # too long for Python to convert by itself
+                import ost_bigint
+                append((TOKENS.NUMBER, ost_bigint.parse(code[i:end])))
+            i = end
+
+        elif c == '`':
+            end = code.find('`', i + 1)
+            if end == -1: end = n
+            append((TOKENS.LITERAL, code[i+1:end]))
+            i = end + 1
+
+        elif c == '{':
+            end = matching(code, i + 1)
+            append((TOKENS.LITERAL, block(code[i+1:end])))
+            i = end + 1
+
+        elif c in '"_:':
+            if i + 1 < n:
+                x = code[i+1]
+                if c == ':':
+                    append((TOKENS.ASSIGN, x))
+                else:
+                    append((TOKENS.LITERAL, x if c == '"' else block(x)))
+            i += 2
+
+        else:
+            append((TOKENS.INSTR, c))
+            i += 1
+
+    return tokens
+
+
+# the index of the } that closes a block whose body starts at i, or the end
+# of the code if it is never closed
+def matching(code, i):
+    nestcount = 1
+    opening = code.find('{', i)
+    while True:
+        closing = code.find('}', i)
+        if closing == -1:
+            return len(code)
+        while opening != -1 and opening < closing:
+            nestcount += 1
+            opening = code.find('{', opening + 1)
+        nestcount -= 1
+        if nestcount == 0:
+            return closing
+        i = closing + 1
+
+
+# a number token spelled out as single-digit instructions; only used when a
+# digit has been assigned to, so that variable lookup still sees each digit
+def spell(number):
+    return [(TOKENS.INSTR, d) for d in str(number)]
+
+# just for convenience
+block = ost_stack.Block
@@ -0,0 +1,235 @@
+import ost_budget, ost_cache, ost_instructions, ost_optimize, ost_stack, ost_tokenizer
+
+
+# opcodes; every instruction is an (opcode, operand) pair of ints in a flat
+# list, and the operand indexes into the constant pool; OPT runs an
+# ost_optimize.Optimized
+OPS = ost_stack.Enum(PUSH=0, NUMBER=1, ASSIGN=2, CALL=3, OPT=4)
+
+
+class Code:
+    '''
+    A compiled Ostrich program: `ops` holds opcode/operand pairs, `consts`
+    the pool of values, variable names and instruction characters that the
+    operands refer to.
+    '''
+    __slots__ = ('ops', 'consts')
+
+    def __init__(self, ops, consts):
+        self.ops = ops
+        self.consts = consts
+
+
+def compile(code):
+    '''
+    Lower Ostrich source (or a block) to bytecode.
+    '''
+    return assemble(ost_tokenizer.tokenize(code))
+
+
+def assemble(tokens):
+    '''
+    Lower a token list to bytecode. Equal constants share one slot in the
+    pool.
+    '''
+    ops, consts, slots = [], [], {}
+    for kind, val in tokens:
+        # blocks and strings with the same text must not share a slot
+        key = (type(val), val)
+        slot = slots.get(key)
+        if slot is None:
+            slot = slots[key] = len(consts)
+            consts.append(val)
+        ops.append(OPCODES[kind])
+        ops.append(slot)
+    return Code(ops, consts)
+
+
+def disassemble(code):
+    '''
+    The token list code was assembled from.
+    '''
+    return [(KINDS[op], code.consts[slot])
+            for op, slot in zip(code.ops[::2], code.ops[1::2])]
+
+
+# put `head` in front of what is left of a running program; the operands of
+# the remaining ops move up by the size of head's constant pool
+def splice(head, ops, consts, pc):
+    rest = ops[pc:]
+    rest[1::2] = [slot + len(head.consts) for slot in rest[1::2]]
+    return head.ops + rest, head.consts + consts
+
+
+def run(prgm, source):
+    '''
+    Run source on prgm's stack with the bytecode dispatch loop. This has
+    exactly the semantics of Ostrich#interpret.
+    '''
+    execute(prgm, prepare(prgm, source))
+
+
+# the bytecode prgm runs for source
+def prepare(prgm, source):
+    if prgm.optimize and not prgm.shadowed:
+        return optimized(source)
+    return compiled(source)
+
+
+def execute(prgm, code):
+    stk = prgm.stack
+    variables = prgm.variables
+    TABLE = ost_instructions.TABLE
+    profiler = prgm.profiler
+    tracer = prgm.tracer
+    budget = prgm.budget
+    ops, consts = code.ops, code.consts
+    markers = []
+    pc, end = 0, len(ops)
+    prgm.state = None
+    # the blocks being called, as in Ostrich#execute
+    frames = []
+    own = True
+
+    try:
+        while True:
+            if pc == end:
+                if not frames:
+                    break
+                if own:
+                    while markers:
+                        stk.append(stk.popn(-markers.pop()))
+                    prgm.state = None
+                if tracer is not None:
+                    tracer.leave()
+                ops, consts, pc, markers, own = frames.pop()
+                end = len(ops)
+                prgm.depth -= 1
+                continue
+
+            if tracer is not None:
+                tracer.tick(pc >> 1)
+            if budget is not None:
+                budget.tick(prgm)
+            op = ops[pc]
+            val = consts[ops[pc+1]]
+            pc += 2
+
+            if op == OPS.CALL:
+                var = variables.get(val)
+                if var is not None:
+                    if OS.typeof(var) != OST.BLOCK:
+                        stk.append(var)
+                        continue
+                    block, name = var, val
+                else:
+                    o = ord(val)
+                    handler = TABLE[o] if o < len(TABLE) else unknowninstr
+                    if profiler is None:
+                        state = prgm.state = handler(val, stk, prgm)
+                    else:
+                        state = prgm.state = profiler.call(handler, val, stk,
+                                                           prgm)
+                    if state == OST.ARRAY:
+                        markers.append(len(stk))
+                    elif state == -OST.ARRAY:
+                        mark = markers.pop() if markers else 0
+                        stk.append(stk.popn(-mark))
+                    elif state == OS.XSTATE.EXIT:
+                        while not own:
+                            if tracer is not None:
+                                tracer.leave()
+                            ops, consts, pc, markers, own = frames.pop()
+                            prgm.depth -= 1
+                        if not frames:
+                            break
+                        pc = end
+                    if state != OS.XSTATE.CALL:
+                        continue
+                    block, name = prgm.callee, None
+                    prgm.callee = prgm.state = None
+                    if budget is not None:
+                        budget.tick(prgm)
+
+                # call the block
+                if pc == end and frames and (not own or not markers):
+                    if tracer is not None:
+                        tracer.leave()
+                    own = own or name is None
+                else:
+                    if prgm.depth >= prgm.max_depth:
+                        raise ost_budget.BudgetExceeded('depth', stk)
+                    frames.append((ops, consts, pc, markers, own))
+                    prgm.depth += 1
+                    own = name is None
+                if name is None:
+                    markers = []
+                    if tracer is not None:
+                        tracer.enter(block)
+                elif tracer is not None:
+                    tracer.call(name)
+                called = prepare(prgm, block)
+                ops, consts = called.ops, called.consts
+                pc, end = 0, len(ops)
+
+            elif op == OPS.OPT:
+                if not prgm.shadowed and (budget is None or
+                                          budget.charge(prgm, val.weight - 1)):
+                    val.run(prgm)
+                else:
+                    # one token at a time, each counted on its own
+                    if budget is not None:
+                        budget.untick()
+                    ops, consts = splice(assemble(val.original), ops, consts,
+                                         pc)
+                    pc, end = 0, len(ops)
+
+            elif op == OPS.PUSH:
+                stk.append(val)
+
+            elif op == OPS.NUMBER:
+                if prgm.digitvars:
+                    spelled = assemble(ost_tokenizer.spell(val))
+                    if tracer is not None:
+                        tracer.splice(len(spelled.ops) >> 1, pc >> 1)
+                    ops, consts = splice(spelled, ops, consts, pc)
+                    pc, end = 0, len(ops)
+                    prgm.state = None
+                else:
+                    stk.append(val)
+
+            elif op == OPS.ASSIGN:
+                variables[val] = stk[-1]
+                if val in ost_instructions.STOCK:
+                    prgm.shadowed = True
+                    if val in ost_tokenizer.DIGITS:
+                        prgm.digitvars = True
+    finally:
+        prgm.depth -= len(frames)
+        if tracer is not None:
+            for _ in frames:
+                tracer.leave()
+
+    prgm.state = None
+
+    while markers:
+        stk.append(stk.popn(-markers.pop()))
+
+
+# bytecode for every program and block run by the VM
+compiled = ost_cache.LRUCache(compile)
+
+# optimized bytecode, made from the compiled (so that programs loaded by
+# ost_diskcache are not parsed again)
+optimized = ost_cache.LRUCache(
+    lambda code: assemble(ost_optimize.optimize(disassemble(compiled(code)))))
+
+# just for convenience
+OS = ost_stack.Stack
+OST = ost_stack.Stack.TYPES
+TOK = ost_tokenizer.TOKENS
+unknowninstr = ost_instructions.unknowninstr
+OPCODES = {TOK.LITERAL: OPS.PUSH, TOK.NUMBER: OPS.NUMBER,
+           TOK.ASSIGN: OPS.ASSIGN, TOK.INSTR: OPS.CALL,
+           TOK.OPTIMIZED: OPS.OPT}
+KINDS = {op: kind for kind, op in OPCODES.items()}
@@ -1,11 +1,10 @@
 #!/usr/bin/env python3
 
-from collections import defaultdict
-import itertools
 import sys  # sys.exit, sys.stdin, sys.stdout
 
-# Ostrich internal libs
-import ost_instructions, ost_repl, ost_stack
+# Ostrich internal libs; ost_batch, ost_repl and ost_server are only
+# imported by the command line modes that use them
+import ost_budget, ost_cache, ost_instructions, ost_io, ost_optimize, ost_profile, ost_stack, ost_tokenizer, ost_vm
 
 
 class Ostrich:
@@ -15,133 +14,455 @@ class Ostrich:
     # VERSION_DESC = None
     VERSION_DESC = 'alpha'
 
-    def __init__(self):
+    # ref walks the token list, vm runs compiled bytecode (see ost_vm)
+    ENGINES = ('ref', 'vm')
+
+    # how deep blocks may call each other by default
+    MAX_DEPTH = 100000
+
+    # vectorize lets % and * run arithmetic blocks over numeric arrays with
+    # NumPy (when it is installed; see ost_numeric); S, G and N read from
+    # stdin, a text stream that defaults to sys.stdin; P writes to stdout,
+    # anything ost_io.Output accepts, buffering up to bufsize characters;
+    # profile counts and times every builtin, trace follows the stack of
+    # blocks for flame graphs (see ost_profile); max_instructions,
+    # time_limit (seconds) and max_memory (bytes) limit each run, which
+    # raises ost_budget.BudgetExceeded when one runs out; optimize runs
+    # straight-line code folded and fused (see ost_optimize), except while
+    # profiling or tracing, which count every token; max_depth is how many
+    # blocks (called by name, ~ or I) may be running at once, beyond which
+    # a run raises ost_budget.BudgetExceeded too
+    def __init__(self, engine='ref', vectorize=True, stdin=None, stdout=None,
+                 bufsize=1 << 16, profile=False, trace=False,
+                 max_instructions=None, time_limit=None, max_memory=None,
+                 optimize=True, max_depth=MAX_DEPTH):
+        if engine not in Ostrich.ENGINES:
+            raise ValueError('Unknown engine %r' % engine)
+        self.engine = engine
+        self.vectorize = vectorize
+        self.input = ost_io.Input(stdin)
+        self.output = ost_io.Output(stdout, bufsize)
+        self.profiler = ost_profile.Profiler() if profile else None
+        self.tracer = ost_profile.Tracer() if trace else None
+        self.budget = None
+        if (max_instructions, time_limit, max_memory) != (None,) * 3:
+            self.budget = ost_budget.Budget(max_instructions, time_limit,
+                                            max_memory)
         self.stack = OS()
         self.variables = ost_instructions.ost_variables()
         self.state = None
+        self.digitvars = False  # whether any digit has been assigned to
+        self.optimize = optimize and not profile and not trace
+        # whether any builtin has been assigned to; optimized code relies on
+        # the builtins, so from then on the original tokens run instead
+        self.shadowed = False
+        # the engines keep their own stack of the blocks they call, so that
+        # recursion does not use up Python's
+        self.max_depth = max_depth
+        self.depth = 0
+        self.callee = None  # what ~ or I asked to run (see XSTATE.CALL)
+        self.calls = 0  # how many calls are running (see call)
 
+    # run code and return the rendered stack (same as call + render)
     def run(self, code):
+        self.call(code)
+        return self.render()
+
+    # run code and return the stack as a list of Python values
+    def evaluate(self, code):
+        self.call(code)
+        return list(map(OS.native, self.stack))
+
+    # the stack as it is shown by the REPL
+    def render(self):
+        return ' '.join(map(OS.inspect, self.stack))
+
+    # push args as they are (no round trip through source) and run code
+    # on top of them; this is what builtins use to run blocks. P output is
+    # flushed when the outermost call returns
+    def call(self, code, *args):
+        self.stack.extend(args)
+        self.calls += 1
+        if self.tracer is not None:
+            self.tracer.enter(code)
+        if self.budget is not None:
+            self.budget.enter(self)
+        try:
+            if self.engine == 'vm':
+                ost_vm.execute(self, ost_vm.prepare(self, code))
+            else:
+                self.execute(self.parsed(code))
+        except RecursionError:
+            # blocks run by builtins that run blocks, nested too deep
+            raise ost_budget.BudgetExceeded('depth', self.stack) from None
+        finally:
+            if self.tracer is not None:
+                self.tracer.leave()
+            if self.budget is not None:
+                self.budget.leave()
+            self.calls -= 1
+            if not self.calls:
+                self.output.flush()
+
+    def loop(self, code):
+        '''
+        A function that runs code like call(code) does, for builtins that
+        run the same block over and over. A block of straight-line code is
+        optimized once and then runs as one ost_optimize.Optimized, without
+        going through the engine or setting up a call; any other block is
+        called as usual.
+        '''
+        body = None
+        if self.optimize and not self.shadowed:
+            body = ost_optimize.bodies(code)
+        if body is None:
+            return lambda: self.call(code)
+        budget = self.budget
+
+        def step():
+            # as counted by call: one for the call, and the tokens
+            if not self.shadowed and (
+                    budget is None or budget.charge(self, body.weight + 1)):
+                body.run(self)
+            else:
+                self.call(code)
+        return step
+
+    # the tokens interpret runs for code
+    def parsed(self, code):
+        if self.optimize and not self.shadowed:
+            return ost_optimize.optimized(code)
+        return ost_cache.parsed(code)
+
+    def interpret(self, code):
+        self.execute(self.parsed(code))
+
+    # run a token list (see parsed)
+    def execute(self, tokens):
         self.state = None
-        cumulstr = ''  # string, block
-        nestcount = 1  # block
         markers = []   # array
-        INSTRUCTIONS = ost_instructions.ost_instructions()
+        TABLE = ost_instructions.TABLE
+        profiler = self.profiler
+        tracer = self.tracer
+        budget = self.budget
+        pos = 0
+        # the blocks being called, as (tokens, pos, markers, own) of the
+        # caller to go back to; own is whether the running tokens have
+        # markers of their own, as blocks run by ~ and I do, and those
+        # called by name do not (they are spliced in, as it were)
+        frames = []
+        own = True
 
-        while code:
+        try:
+            while True:
+                if pos == len(tokens):
+                    if not frames:
+                        break
+                    # the block is done; return to its caller
+                    if own:
+                        while markers:
+                            self.stack.append(
+                                self.stack.popn(-markers.pop()))
+                        self.state = None
+                    if tracer is not None:
+                        tracer.leave()
+                    tokens, pos, markers, own = frames.pop()
+                    self.depth -= 1
+                    continue
 
-            instr = code[0]
-            code = code[1:]
+                if tracer is not None:
+                    tracer.tick(pos)
+                if budget is not None:
+                    budget.tick(self)
+                kind, val = tokens[pos]
+                pos += 1
 
-            if self.state == OST.STRING:
-                if instr == '`':
-                    self.stack.append(cumulstr)
-                    cumulstr = ''
-                    self.state = None
-                else:
-                    cumulstr += instr
-
-            elif self.state == OST.BLOCK:
-                if instr == '}':
-                    nestcount -= 1
-                    if nestcount == 0:
-                        self.stack.append(block(cumulstr))
-                        cumulstr = ''
-                        nestcount = 1  # reset for next time
+                if kind == TOK.LITERAL:
+                    self.stack.append(val)
+                    continue
+
+                elif kind == TOK.NUMBER:
+                    if self.digitvars:
+                        # a digit is a variable; go one character at a time
+                        spelled = ost_tokenizer.spell(val)
+                        if tracer is not None:
+                            tracer.splice(len(spelled), pos)
+                        tokens = spelled + tokens[pos:]
+                        pos = 0
                         self.state = None
                     else:
-                        cumulstr += instr
-                else:
-                    cumulstr += instr
-                    if instr == '{':
-                        nestcount += 1
+                        self.stack.append(val)
+                    continue
 
-            elif self.state == OS.XSTATE.ASSIGN:
-                self.variables[instr] = self.stack[-1]
-                self.state = None
+                elif kind == TOK.ASSIGN:
+                    self.variables[val] = self.stack[-1]
+                    if val in ost_instructions.STOCK:
+                        self.shadowed = True
+                        if val in ost_tokenizer.DIGITS:
+                            self.digitvars = True
+                    continue
 
-            elif self.state == OS.XSTATE.CHAR:
-                self.stack.append(instr)
-                self.state = None
-
-            elif self.state == OS.XSTATE.CHARBLOCK:
-                self.stack.append(block(instr))
-                self.state = None
+                elif kind == TOK.OPTIMIZED:
+                    if not self.shadowed and (
+                            budget is None or
+                            budget.charge(self, val.weight - 1)):
+                        val.run(self)
+                    else:
+                        # one token at a time, each counted on its own
+                        if budget is not None:
+                            budget.untick()
+                        tokens = val.original + tokens[pos:]
+                        pos = 0
+                    continue
 
-            else:
-                var = self.variables[instr]
+                var = self.variables.get(val)
                 if var is not None:
-                    if OS.typeof(var) == OST.BLOCK:
-                        code = var + code
-                    else:
+                    if OS.typeof(var) != OST.BLOCK:
                         self.stack.append(var)
+                        continue
+                    block, name = var, val
                 else:
-                    self.state = INSTRUCTIONS[instr](instr, self.stack, self)
+                    o = ord(val)
+                    handler = TABLE[o] if o < len(TABLE) else unknowninstr
+                    if profiler is None:
+                        self.state = handler(val, self.stack, self)
+                    else:
+                        self.state = profiler.call(handler, val, self.stack,
+                                                   self)
                     if self.state == OST.ARRAY:
                         markers.append(len(self.stack))
                     elif self.state == -OST.ARRAY:
-                        idx = markers.pop() if markers else 0
-                        self.stack.append(self.stack.popn(-idx))
+                        mark = markers.pop() if markers else 0
+                        self.stack.append(self.stack.popn(-mark))
                     elif self.state == OS.XSTATE.EXIT:
-                        code = ''
+                        # Q leaves the block ~ or I runs, and the blocks it
+                        # called by name
+                        while not own:
+                            if tracer is not None:
+                                tracer.leave()
+                            tokens, pos, markers, own = frames.pop()
+                            self.depth -= 1
+                        if not frames:
+                            break
+                        pos = len(tokens)
+                    if self.state != OS.XSTATE.CALL:
+                        continue
+                    block, name = self.callee, None
+                    self.callee = self.state = None
+                    if budget is not None:
+                        budget.tick(self)  # for the call, as in call()
 
-        # finished parsing instr's
-        # perform final cleanup
+                # call the block
+                if pos == len(tokens) and frames and (not own or not markers):
+                    # a tail call: the block returns where this one would
+                    if tracer is not None:
+                        tracer.leave()
+                    own = own or name is None
+                else:
+                    if self.depth >= self.max_depth:
+                        raise ost_budget.BudgetExceeded('depth', self.stack)
+                    frames.append((tokens, pos, markers, own))
+                    self.depth += 1
+                    own = name is None
+                if name is None:
+                    markers = []
+                    if tracer is not None:
+                        tracer.enter(block)
+                elif tracer is not None:
+                    tracer.call(name)
+                tokens = self.parsed(block)
+                pos = 0
+        finally:
+            # whatever is left after an error
+            self.depth -= len(frames)
+            if tracer is not None:
+                for _ in frames:
+                    tracer.leave()
 
-        if self.state == OST.STRING:
-            self.stack.append(cumulstr)
-        elif self.state == OST.BLOCK:
-            self.stack.append(OS.convert(cumulstr, OST.BLOCK))
+        # finished running tokens
+        # perform final cleanup
         self.state = None
 
         while markers:
             self.stack.append(self.stack.popn(-markers.pop()))
 
-        return ' '.join(map(OS.inspect, self.stack))
-
 # just for convenience
 OS = ost_stack.Stack
 OST = ost_stack.Stack.TYPES
 block = ost_stack.Block
+TOK = ost_tokenizer.TOKENS
+unknowninstr = ost_instructions.unknowninstr
 
 if __name__ == '__main__':
-    # parse command line arguments
-    import argparse
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        'filename', nargs='?',
-        help='path to Ostrich file to execute, - for stdin'
-    )
-    parser.add_argument(
-        '-i', '--interactive', action='store_true',
-        help='enter an interactive REPL instead of executing code'
-    )
-    parser.add_argument(
-        '-e', '--execute', help='execute a string passed as an argument'
-    )
-    parser.add_argument(
-        '-v', '--version', action='store_true',
-        help='get the version of Ostrich that is being run'
-    )
+    # what every option is when it is not given
+    defaults = {
+        'filename': None, 'interactive': False, 'execute': None,
+        'engine': 'ref', 'bufsize': 1 << 16, 'profile': False, 'flame': None,
+        'max_instructions': None, 'time_limit': None, 'max_memory': None,
+        'batch': None, 'serve': None, 'workers': None, 'cache': True,
+        'cache_dir': None, 'cache_size': None, 'optimize': True,
+        'max_depth': Ostrich.MAX_DEPTH, 'version': False
+    }
+    argv = sys.argv[1:]
+    if len(argv) == 1 and argv[0][:1] not in ('', '-') or \
+            len(argv) == 2 and argv[0] in ('-e', '--execute') and argv[1]:
+        # plain `ostrich.py FILE` and `ostrich.py -e CODE` runs skip
+        # argparse, which takes longer to import than all of Ostrich
+        import types
+        args = types.SimpleNamespace(**defaults)
+        if len(argv) == 1:
+            args.filename = argv[0]
+        else:
+            args.execute = argv[1]
+    else:
+        # parse command line arguments
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.set_defaults(**defaults)
+        parser.add_argument(
+            'filename', nargs='?',
+            help='path to Ostrich file to execute, - for stdin'
+        )
+        parser.add_argument(
+            '-i', '--interactive', action='store_true',
+            help='enter an interactive REPL instead of executing code'
+        )
+        parser.add_argument(
+            '-e', '--execute',
+            help='execute a string passed as an argument'
+        )
+        parser.add_argument(
+            '--engine', choices=Ostrich.ENGINES,
+            help='execution engine: ref walks the parsed program, vm compiles \
+it to bytecode first'
+        )
+        parser.add_argument(
+            '--bufsize', type=int,
+            help='how many characters of output to collect before writing \
+them'
+        )
+        parser.add_argument(
+            '--profile', action='store_true',
+            help='print how often each builtin was called and how long it \
+took to stderr'
+        )
+        parser.add_argument(
+            '--flame', metavar='FILE',
+            help='write how many tokens ran in each stack of blocks to FILE, \
+in the collapsed format of flame graph tools'
+        )
+        parser.add_argument(
+            '--max-instructions', type=int, metavar='N',
+            help='stop the program after it executed N instructions'
+        )
+        parser.add_argument(
+            '--time-limit', type=float, metavar='SECONDS',
+            help='stop the program after it ran for SECONDS'
+        )
+        parser.add_argument(
+            '--max-memory', type=ost_budget.parse_size, metavar='BYTES',
+            help='stop the program when its stack takes up about BYTES (with \
+an optional K, M or G suffix)'
+        )
+        parser.add_argument(
+            '--max-depth', type=int, metavar='N',
+            help='stop the program when more than N blocks are running at \
+once, as in deep recursion (default: %d)' % Ostrich.MAX_DEPTH
+        )
+        parser.add_argument(
+            '--batch', metavar='FILE',
+            help='run the jobs in FILE (- for stdin), one JSON object with \
+source, stdin and time_limit per line, and print one JSON result per job as \
+it finishes'
+        )
+        parser.add_argument(
+            '--serve', metavar='SOCKET',
+            help='serve programs on a Unix socket, with the protocol of \
+--batch over each connection'
+        )
+        parser.add_argument(
+            '--workers', type=int,
+            help='how many processes run --batch jobs or serve connections \
+(default: one per CPU)'
+        )
+        parser.add_argument(
+            '--no-cache', dest='cache', action='store_false',
+            help='parse FILE again instead of loading it from the cache of \
+parsed programs'
+        )
+        parser.add_argument(
+            '--cache-dir', metavar='DIR',
+            help='where parsed programs are cached (default: \
+$OSTRICH_CACHE_DIR or ~/.cache/ostrich)'
+        )
+        parser.add_argument(
+            '--cache-size', type=ost_budget.parse_size, metavar='BYTES',
+            help='how many bytes of parsed programs to keep in the cache \
+(default: 32M)'
+        )
+        parser.add_argument(
+            '--no-optimize', dest='optimize', action='store_false',
+            help='run every token as it is written, without folding \
+constants or fusing instructions'
+        )
+        parser.add_argument(
+            '-v', '--version', action='store_true',
+            help='get the version of Ostrich that is being run'
+        )
 
-    args = parser.parse_args()
-    program = Ostrich()
+        args = parser.parse_args(argv)
+
+    budget = {'max_instructions': args.max_instructions,
+              'time_limit': args.time_limit, 'max_memory': args.max_memory,
+              'max_depth': args.max_depth}
+    program = Ostrich(engine=args.engine, bufsize=args.bufsize,
+                      profile=args.profile, trace=bool(args.flame),
+                      optimize=args.optimize, **budget)
     version_string = 'Ostrich v%d.%d.%d%s' % (
         Ostrich.MAJOR_VERSION,
         Ostrich.MINOR_VERSION,
         Ostrich.PATCH_VERSION,
         ' (%s)' % Ostrich.VERSION_DESC if Ostrich.VERSION_DESC else ''
     )
+
+    def execute(code):
+        # output is flushed even if the program fails
+        try:
+            program.call(code)
+            for x in program.stack:
+                program.output.emit(x)
+        except ost_budget.BudgetExceeded as e:
+            sys.exit('Ostrich: %s' % e)
+        finally:
+            program.output.flush()
+            if program.profiler:
+                print(program.profiler.report(), file=sys.stderr)
+            if program.tracer:
+                with open(args.flame, 'w') as f:
+                    f.write(program.tracer.collapsed())
+
     if args.interactive:
+        import ost_repl
         print('''This is %s
 Type any command or \\\\help for help.''' % version_string)
         ost_repl.ost_repl(program)
     elif args.version:
         print(version_string)
+    elif args.batch:
+        import ost_batch
+        ost_batch.main(args.batch, Ostrich, dict(budget, engine=args.engine,
+                                                 bufsize=args.bufsize,
+                                                 optimize=args.optimize),
+                       args.workers)
+    elif args.serve:
+        import ost_server
+        ost_server.serve(args.serve, Ostrich, dict(budget, engine=args.engine,
+                                                   bufsize=args.bufsize,
+                                                   optimize=args.optimize),
+                         args.workers)
     elif args.execute:
         # execute code!
-        program.run(args.execute)
-        for x in program.stack:
-            sys.stdout.write(OS.tostr(x))
+        execute(args.execute)
     elif args.filename:
         # resolve path, get code
         code = None
@@ -154,9 +475,17 @@ Type any command or \\\\help for help.''' % version_string)
                 sys.exit('Ostrich: Path %s does not exist' % path)
             code = open(path).read()
 
+        # load the parsed program and its blocks, like a .pyc
+        if args.cache:
+            import ost_diskcache
+            cache = ost_diskcache.DiskCache(
+                (Ostrich.MAJOR_VERSION, Ostrich.MINOR_VERSION,
+                 Ostrich.PATCH_VERSION), args.cache_dir,
+                ost_diskcache.MAXSIZE if args.cache_size is None
+                else args.cache_size)
+            cache.prepare(code, args.engine)
+
         # execute code!
-        program.run(code)
-        for x in program.stack:
-            sys.stdout.write(OS.tostr(x))
+        execute(code)
     else:
-        parser.print_help()
+        parser.print_help()  # only when argparse was needed, for no options
@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+
+'''
+Differential testing: run programs through the reference interpreter
+(Ostrich#interpret without vectorization or optimization) and through
+every alternative way of running them, and compare what each leaves
+behind: the stack, the output and the variables, or the error it raised.
+A program that behaves differently is shrunk to a minimal reproducer.
+
+    python3 test/differential.py -n 1000 --seed 7
+'''
+
+# namespace shenanigans
+import sys, os
+sys.path.insert(1, os.path.join(sys.path[0], '..') + '/lib')
+
+import io, random, signal
+
+import ost_stack, ost_tokenizer, ostrich
+
+
+# how today's Ostrich#run behaves; everything else must match it
+REFERENCE = {'engine': 'ref', 'vectorize': False, 'optimize': False}
+VARIANTS = {
+    'vm': {'engine': 'vm', 'vectorize': False, 'optimize': False},
+    'vectorize': {'engine': 'ref', 'vectorize': True, 'optimize': False},
+    'vm+vectorize': {'engine': 'vm', 'vectorize': True, 'optimize': False},
+    'optimize': {'engine': 'ref', 'vectorize': False, 'optimize': True},
+    'vm+optimize': {'engine': 'vm', 'vectorize': False, 'optimize': True},
+    'all': {'engine': 'vm', 'vectorize': True, 'optimize': True},
+}
+
+# what S, G and N read
+INPUT = '3 1 4\n1 5 9\n2 6\n'
+
+# seconds a program may run; a program that is too slow for the reference
+# proves nothing
+TIMEOUT = 2
+
+CORPUS = [
+    # numbers, strings, blocks, arrays
+    '1 2 3', '12 34+', '`abc``def`+', '"a "b _c _d', '[1[2[3', '{[1 2}~3',
+    '{"}}', '[1 [2 3]]\'', '1.5 2/', '3 2/', '3 2/1W', '7 2V', '2 3?',
+    '10 2B', '[1 0 1 0]2B', '`abc`(', '`abc`)', '[1 2 3]1<', '[1 2 3]1>',
+    # byprec operand ordering
+    '[1 2]3+', '3[1 2]+', '{a}`b`+', '`b`{a}+', '[1 2 3]2=', '2[1 2 3]=',
+    '3{`x`}*', '{`x`}3*', '[1 2 3]`,`*', '`,`[1 2 3]*',
+    # splits drop empty parts
+    '`hello world` ` `%', '`a,,b,` `,`%', '[1 0 0 2 0]0%', '[1 0 0 2 0][0]%',
+    # blocks run by builtins
+    '[1 2 3]{2*}%', '[1 2 3]{.}%', '5,{2%},', '5,{3<},', '[3 1 2]{~}$',
+    '10,{+}*', '`abc`{1+}%', '1{.1+.5<}(', '3{(.}) ', '[1 2 3]{-1*}/',
+    '[[1 2][3 4]]Z', '1 2 3 4 5 3W', '`aXbXc` `X` {;`Y`}X', '`abc` `b` M',
+    '[1 2 3][2 3 4]&', '[1 2 3][2 3 4]|', '[1 2 3][2 3 4]^',
+    '[1 2 3][2 3 4]-', '[[1][2]1][1[2]]&', '`hello``lo`&',
+    # variables, also on digits and instructions
+    '{`...`+}: d;`wait` `what` `huh?`', '5:1;1 2 3 12', '0 1 2{:x;}~x',
+    '{1}:f; f f f', '{:x;x 1- .{f}{}I}:f; 5 f', '5:+;1 2+', '7:1;12 3',
+    '{+}:*;2 3*', '{{2}:+;}~ 1 1+', '{1}:~;{2}~', '1 2+{3}:+;4 5+',
+    # constants folded, pairs fused, blocks inlined
+    '2 3*4+', '`ab`3*', '1.5 2*', '[1 2]3*', '5 0%', '{2 3+}~ 1{1+}~',
+    '3.:x;x*', '`a`.+', '[1].+', '{3 4*}:f;f', '1 2 3;;', '`ab`(\\',
+    # output and input
+    '1P 2P [3 4]P', 'G G S', 'N{2*}%', '1 2Q 3',
+    # strings and arrays built up in loops
+    '`` 300{`ab`+}* ,', '`` 300{.,`x`#}* ,', '[]300{.,#}*,',
+    # big enough to be vectorized
+    '300,{2*}%{+}*', '300,{1+3%}%{7%},', '300,{.*7%}%', '300,{3V}%',
+    '300,{~A(}%', '300,{5<}%', '300,{2\\-}%', '300,{;}%', '300,{;;}%',
+    '300,{0%}%', '300,{&}*', '300,{-}*', '300,{*}*', '400,2%{.3*}%',
+    '1:2;300,{2*}%', '300,{`x`}%,', '300,{2/}%',
+]
+
+
+class Timeout(Exception):
+    pass
+
+
+def on_alarm(signum, frame):
+    raise Timeout()
+
+
+# how a value compares: its rendering, and its type (1 and 1.0 render
+# differently, but a string and a rope or a list and a NumArray do not)
+def key(x):
+    return OS.inspect(x), repr(OS.native(x))
+
+
+def outcome(code, options, timeout=TIMEOUT):
+    '''
+    Run code on a fresh interpreter made with options. Returns the stack,
+    the output, the variables that are set and the name of the exception
+    raised (or None), which is 'Timeout' if it ran too long.
+    '''
+    out = io.StringIO()
+    program = ostrich.Ostrich(stdin=io.StringIO(INPUT), stdout=out,
+                              **options)
+    error = None
+    timed = timeout and hasattr(signal, 'setitimer')
+    if timed:
+        handler = signal.signal(signal.SIGALRM, on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        program.call(code)
+    except Exception as e:
+        error = type(e).__name__
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, handler)
+    program.output.flush()
+    return {
+        'stack': list(map(key, program.stack)),
+        'stdout': out.getvalue(),
+        'variables': {name: key(x) for name, x in program.variables.items()
+                      if x is not None},
+        'error': error,
+    }
+
+
+def compare(code, options, timeout=TIMEOUT):
+    '''
+    None if code behaves the same with options as with the reference, or
+    both outcomes if it does not.
+    '''
+    expected = outcome(code, REFERENCE, timeout)
+    if expected['error'] in ('Timeout', 'MemoryError', 'RecursionError'):
+        return None
+    actual = outcome(code, options, timeout)
+    return None if actual == expected else (expected, actual)
+
+
+# Ostrich source for a token list
+def source(tokens):
+    parts = []
+    for i, (kind, val) in enumerate(tokens):
+        if kind == TOK.NUMBER:
+            if i and tokens[i-1][0] == TOK.NUMBER:
+                parts.append(' ')
+            parts.append(str(val))
+        elif kind == TOK.ASSIGN:
+            parts.append(':' + val)
+        elif kind == TOK.INSTR:
+            parts.append(val)
+        elif type(val) is block:
+            parts.append('_' + val if len(val) == 1 else '{%s}' % val)
+        else:
+            parts.append('"' + val if len(val) == 1 else '`%s`' % val)
+    return ''.join(parts)
+
+
+def shrink(code, fails):
+    '''
+    The smallest program found (by dropping runs of tokens and shrinking
+    the bodies of blocks) for which fails(program) is still true.
+    '''
+    tokens = ost_tokenizer.tokenize(code)
+    if not fails(source(tokens)):
+        return code
+
+    changed = True
+    while changed:
+        changed = False
+        size = len(tokens)
+        while size:
+            i = 0
+            while i < len(tokens):
+                candidate = tokens[:i] + tokens[i+size:]
+                if candidate and fails(source(candidate)):
+                    tokens = candidate
+                    changed = True
+                else:
+                    i += 1
+            size //= 2
+        for i, (kind, val) in enumerate(tokens):
+            if type(val) is block and val:
+                def fails_with(body):
+                    return fails(source(tokens[:i] + [(kind, block(body))] +
+                                        tokens[i+1:]))
+                body = shrink(val, fails_with)
+                if body != val:
+                    tokens = tokens[:i] + [(kind, block(body))] + tokens[i+1:]
+                    changed = True
+    return source(tokens)
+
+
+# instructions random programs are made of; D, E and R are left out, as
+# they depend on the clock, run Python or are random, and ? as its powers
+# get too big too fast
+INSTRUCTIONS = '!$%&\'()*+,-./;<=>@\\^ABCFGHIMNOPSTVWXYZ~'
+LETTERS = 'abflxy0'
+
+
+def generate(rng, size=8, depth=2):
+    '''
+    A random well-formed program (strings, blocks and arrays are closed) of
+    at most `size` parts, with blocks and arrays nested `depth` deep.
+    '''
+    parts = []
+    for _ in range(rng.randint(1, size)):
+        r = rng.random()
+        if r < 0.2:
+            parts.append(str(rng.randint(0, 9)))
+        elif r < 0.25:
+            parts.append(str(rng.randint(256, 400)))
+        elif r < 0.33:
+            parts.append('`%s`' % ''.join(rng.choice('ab1 ,.') for _ in
+                                          range(rng.randint(0, 4))))
+        elif r < 0.45 and depth:
+            parts.append('{%s}' % generate(rng, size // 2 or 1, depth - 1))
+        elif r < 0.52 and depth:
+            parts.append('[%s]' % generate(rng, size // 2 or 1, depth - 1))
+        elif r < 0.56:
+            parts.append(':' + rng.choice(LETTERS))
+        elif r < 0.6:
+            parts.append(rng.choice(LETTERS))
+        else:
+            parts.append(rng.choice(INSTRUCTIONS))
+    return ' '.join(parts)
+
+
+def random_programs(n, seed=0):
+    rng = random.Random(seed)
+    return [generate(rng) for _ in range(n)]
+
+
+def check(programs, variants=VARIANTS, timeout=TIMEOUT):
+    '''
+    (variant, program, reproducer, expected, actual) for every program
+    that behaves differently with one of the variants.
+    '''
+    mismatches = []
+    for code in programs:
+        for name, options in sorted(variants.items()):
+            diff = compare(code, options, timeout)
+            if diff is None:
+                continue
+            reproducer = shrink(code, lambda c: compare(c, options, timeout)
+                                is not None)
+            expected, actual = compare(reproducer, options, timeout) or diff
+            mismatches.append((name, code, reproducer, expected, actual))
+    return mismatches
+
+
+# just for convenience
+OS = ost_stack.Stack
+TOK = ost_tokenizer.TOKENS
+block = ost_stack.Block
+
+if __name__ == '__main__':
+    # parse command line arguments
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='compare alternative ways of running Ostrich with the \
+reference interpreter'
+    )
+    parser.add_argument(
+        'programs', nargs='*', metavar='program',
+        help='programs to compare (default: the corpus and random programs)'
+    )
+    parser.add_argument(
+        '-n', type=int, default=500, help='how many random programs to run'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0, help='seed for the random programs'
+    )
+    parser.add_argument(
+        '--variant', action='append', choices=sorted(VARIANTS),
+        help='variant to compare (default: all)'
+    )
+
+    args = parser.parse_args()
+    variants = {name: VARIANTS[name] for name in args.variant or VARIANTS}
+    programs = args.programs or CORPUS + random_programs(args.n, args.seed)
+
+    mismatches = check(programs, variants)
+    for name, code, reproducer, expected, actual in mismatches:
+        print('%s: %r' % (name, code))
+        print('  reproducer: %r' % reproducer)
+        for field in expected:
+            if expected[field] != actual[field]:
+                print('  %s: %r != %r' % (field, expected[field],
+                                          actual[field]))
+    print('%d programs, %d variants, %d mismatches' % (
+        len(programs), len(variants), len(mismatches)))
+    sys.exit(1 if mismatches else 0)
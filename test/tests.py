@@ -1,10 +1,12 @@
 #!/usr/bin/python3
 
 # namespace shenanigans
-import sys, os
+import sys, os, io, subprocess, tempfile, time, multiprocessing
 sys.path.insert(1, os.path.join(sys.path[0], '..') + '/lib')
 
-import ostrich
+import ost_batch, ost_bigint, ost_budget, ost_cache, ost_diskcache, ost_instructions, ost_io
+import ost_numeric, ost_optimize, ost_server, ost_stack, ost_vm, ostrich
+import differential
 import unittest
 
 
@@ -16,6 +18,11 @@ class OstrichTests(unittest.TestCase):
     def expect(self, code, result):
         self.assertEqual(self.program.run(code), result)
 
+    def test_evaluate(self):
+        self.assertEqual(self.program.evaluate('1 `a` [2 {b}]'),
+                         [1, 'a', [2, 'b']])
+        self.assertEqual(self.program.render(), '1 `a` [2 {b}]')
+
     def test_whitespace(self):
         self.expect('   \n  \n\n', '')
 
@@ -55,10 +62,16 @@ class OstrichTests(unittest.TestCase):
         # TODO stack nth (number)
 
     def test_mod(self):
-        pass  # TODO
+        self.expect('[1 2 3]{2*}%', '[2 4 6]')
+        self.expect(';[[1 2][3]]{,}%', '[2 1]')
+        self.expect(';3 2/1W{2*}%', '[3.000000]')
+        self.expect(';`ab`{.+}%', '[`aa` `bb`]')
 
     def test_bitand(self):
-        pass  # TODO
+        self.expect('[3 1 2 1][1 3]&', '[3 1 1]')
+        self.expect(';[[1][2]1][1[2]]&', '[[2] 1]')
+        self.expect(';`hello``lo`&', '`llo`')
+        self.expect(';6 3&', '2')
 
     def test_inspect(self):
         pass  # TODO
@@ -88,10 +101,15 @@ class OstrichTests(unittest.TestCase):
         self.expect(';2 2+', '4')
 
     def test_comma(self):
-        pass  # TODO
+        self.expect('5,', '[0 1 2 3 4]')
+        self.expect(',', '5')
+        self.expect(';5,{2%},', '[1 3]')
+        self.expect(';[`a`"`+`b`+ `c`]{,3=},', '[`a`b`]')
 
     def test_minus(self):
-        pass  # TODO
+        self.expect('[3 1 2 1][1]-', '[3 2]')
+        self.expect(';[[1][2]][[1]]-', '[[2]]')
+        self.expect(';`hello``l`-', '`heo`')
 
     def test_duplicate(self):
         self.expect('42.', '42 42')
@@ -101,10 +119,13 @@ class OstrichTests(unittest.TestCase):
         pass  # TODO
 
     def test_num(self):
-        pass  # TODO
+        self.expect('42', '42')
+        self.expect(';12 034', '12 34')
 
     def test_assign(self):
-        pass  # TODO
+        self.expect('42:a;a a', '42 42')
+        self.expect(';;{1+}:f;1f f', '3')
+        self.expect(';7:1;12 3', '7 2 3')
 
     def test_pop(self):
         self.expect('42;', '')
@@ -150,7 +171,8 @@ class OstrichTests(unittest.TestCase):
         self.expect(']', '[[[1 2 3] 1]]')
 
     def test_bitxor(self):
-        pass  # TODO
+        self.expect('[1 2 3][3 4]^', '[1 2 4]')
+        self.expect(';[[1]`a`][`a`[2]]^', '[[1] [2]]')
 
     def test_backtick(self):
         self.expect('`foo`', '`foo`')
@@ -161,7 +183,8 @@ class OstrichTests(unittest.TestCase):
         # TODO escaping (not implemented)
 
     def test_letter_B(self):
-        pass  # TODO
+        self.expect('255 16B 10 2B [1 2 3]10B 0 7B [3 15]16B [1 12]10B 3 2/3B',
+                    '[15 15] [1 0 1 0] 123 [] 63 22 [1.500000]')
 
     def test_letter_E(self):
         pass  # TODO
@@ -185,7 +208,9 @@ class OstrichTests(unittest.TestCase):
         pass  # TODO
 
     def test_bitor(self):
-        pass  # TODO
+        self.expect('[3 1 3][2 1]|', '[3 1 2]')
+        self.expect(';[[1][1]2][[1]]|', '[[1] 2]')
+        self.expect(';`abc``cd`|', '`abcd`')
 
     def test_rightcurlybracket(self):
         pass  # TODO
@@ -196,5 +221,514 @@ class OstrichTests(unittest.TestCase):
         self.expect(';`1 1+`~', '2')
         self.expect(';42~', '-42')
 
+
+class CacheTests(unittest.TestCase):
+
+    def test_lru(self):
+        cache = ost_cache.LRUCache(len, maxsize=2)
+        self.assertEqual(cache('a'), 1)
+        self.assertEqual(cache('bb'), 2)
+        self.assertEqual(cache('a'), 1)
+        cache('ccc')  # evicts 'bb'
+        self.assertEqual(list(cache.entries), ['a', 'ccc'])
+        self.assertEqual((cache.hits, cache.misses, cache.evictions),
+                         (1, 3, 1))
+
+    def test_blocks_parsed_once(self):
+        ost_cache.parsed.clear()
+        ostrich.Ostrich().run('1 100{2*}*')
+        self.assertEqual(ost_cache.parsed.misses, 2)
+
+
+class RegisterTests(unittest.TestCase):
+
+    def tearDown(self):
+        ost_instructions.BUILTINS.pop('\u20ac', None)
+        ost_instructions.build_table()
+
+    def test_register(self):
+        @ost_instructions.register('\u20ac', arity=2)
+        def euro(a, b):
+            return a * 100 + b, 'c'
+        self.assertEqual(ostrich.Ostrich().run('3 14\u20ac'), '314 `c`')
+        self.assertIs(ost_instructions.lookup('\u20ac').__doc__, None)
+        self.assertIs(ost_instructions.lookup('\u0100'),
+                      ost_instructions.unknowninstr)
+
+
+class NumArrayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.program = ostrich.Ostrich()
+
+    def test_compact(self):
+        self.assertIs(type(self.program.evaluate('5,')[0]), list)
+        self.assertIs(type(self.program.stack[0]), ost_stack.NumArray)
+        self.assertEqual(self.program.run('[0 1 2 3 4]='), '1')
+        self.assertEqual(self.program.run(';5,!0,!'), '0 1')
+
+    def test_degrade(self):
+        self.assertEqual(self.program.run('3,`a`+'), '[0 1 2 `a`]')
+        self.assertIs(type(self.program.stack[-1]), list)
+        self.assertEqual(self.program.run(';3,1 `x`#'), '[0 `x` 2]')
+        self.assertEqual(self.program.run(';[3,[4]]F'), '[0 1 2 4]')
+        self.assertEqual(self.program.run(';3,3,|'), '[0 1 2]')
+
+
+class BigIntTests(unittest.TestCase):
+
+    def test_digits(self):
+        def plain(n, base):
+            ds = []
+            while n:
+                n, d = divmod(n, base)
+                ds.append(d)
+            return ds[::-1]
+        n = 7 ** 5000
+        for base in (2, 3, 8, 10, 16, 64, 1000, 1 << 40):
+            ds = ost_bigint.digits(n, base)
+            self.assertEqual(ds, plain(n, base))
+            self.assertEqual(ost_bigint.undigits(ds, base), n)
+        self.assertEqual(ost_bigint.digits(0, 10), [])
+        # any digits and any base, as B takes them
+        self.assertEqual(ost_bigint.undigits([-1, 20] * 20, -3),
+                         sum(d * (-3) ** i
+                             for i, d in enumerate([20, -1] * 20)))
+
+    def test_decimal(self):
+        # more digits than Python converts by itself
+        program = ostrich.Ostrich()
+        shown = program.run('10 5000?(')
+        self.assertEqual(shown, '9' * 5000)
+        self.assertEqual(program.run('``+~ 10 5000?(='), '1')
+        self.assertEqual(program.run(';0 10 5000?-'), '-1' + '0' * 5000)
+        self.assertEqual(program.run(';10 5000?10B 10B'), '1' + '0' * 5000)
+        self.assertEqual(ost_bigint.parse(' -%s\n' % shown), 1 - 10 ** 5000)
+        with self.assertRaises(ValueError):
+            ost_bigint.parse('1' * 5000 + 'x')
+
+
+class InputTests(unittest.TestCase):
+
+    TEXT = 'first line\r\n12 -3\n\n 45\n'
+
+    def check(self, stream):
+        program = ostrich.Ostrich(stdin=stream)
+        self.assertEqual(program.evaluate('G N'), ['first line', [12, -3, 45]])
+        self.assertIs(type(program.stack[-1]), ost_stack.NumArray)
+        self.assertRaises(EOFError, program.call, 'G')
+
+    def test_stream(self):
+        self.check(io.StringIO(self.TEXT, newline=None))
+
+    def test_mapped(self):
+        with tempfile.TemporaryFile('w+', newline='') as f:
+            f.write(self.TEXT)
+            f.seek(0)
+            self.check(f)
+            f.seek(0)
+            self.assertEqual(list(ost_io.Input(f).lines()),
+                             ['first line', '12 -3', '', ' 45'])
+
+    def test_chunks(self):
+        chunk, ost_io.CHUNK = ost_io.CHUNK, 4
+        try:
+            nums = ost_io.Input(io.StringIO('123 45678 9 %d 1' % 2**70)).ints()
+        finally:
+            ost_io.CHUNK = chunk
+        self.assertEqual(nums, [123, 45678, 9, 2**70, 1])
+
+
+class OutputTests(unittest.TestCase):
+
+    def test_buffered(self):
+        writes = []
+        program = ostrich.Ostrich(stdout=writes.append, bufsize=4)
+        program.call('`ab`P`cd`P`e`P')
+        self.assertEqual(writes, ['abcd', 'e'])
+        program.call('`f`PQ`g`P')
+        self.assertEqual(writes, ['abcd', 'e', 'f'])
+
+    def test_flushed_on_return(self):
+        out = io.StringIO()
+        program = ostrich.Ostrich(stdout=out)
+        program.run('`hi`P [1]{`x`P}%')
+        self.assertEqual(out.getvalue(), 'hix')
+
+    def test_emit(self):
+        out = ost_io.Output(io.BytesIO())
+        value = [1, [2, [], 'x\u20ac'], ost_stack.NumArray('q', range(3000))]
+        out.emit(value)
+        out.flush()
+        self.assertEqual(out.writer.getvalue().decode('utf-8'),
+                         ost_stack.Stack.tostr(value))
+
+
+class ProfileTests(unittest.TestCase):
+
+    def test_counts(self):
+        program = ostrich.Ostrich(profile=True)
+        program.call('1 2+`a`\\+ [3]{)}%')
+        stats = program.profiler.as_dict()
+        self.assertEqual(stats['+']['calls'], 2)
+        self.assertEqual(stats['+']['operands'],
+                         {'NUMBER NUMBER': 1, 'STRING NUMBER': 1})
+        self.assertEqual(stats[')']['calls'], 1)
+        self.assertGreaterEqual(stats['%']['total'], stats['%']['self'])
+        self.assertIn('NUMBER NUMBER 1', program.profiler.report())
+        self.assertIsNone(ostrich.Ostrich().profiler)
+
+
+class TraceTests(unittest.TestCase):
+
+    def test_stacks(self):
+        for engine in ostrich.Ostrich.ENGINES:
+            program = ostrich.Ostrich(engine=engine, trace=True)
+            program.call('{1+}:f;1f [1 2]{)}%')
+            counts = program.tracer.counts
+            self.assertEqual(counts['main@4;f@0'], 1)
+            self.assertEqual(counts['main@4;f@1'], 1)
+            self.assertEqual(counts['main@12;{)}@0'], 2)
+            self.assertEqual(sum(counts.values()), 17)
+            self.assertIn('main@4;f@1 1\n', program.tracer.collapsed())
+
+    def test_escape(self):
+        program = ostrich.Ostrich(trace=True)
+        program.call('1{;1}~')
+        self.assertEqual(program.tracer.counts['main@2;{\\x3b1}@1'], 1)
+
+
+class RopeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.program = ostrich.Ostrich()
+
+    def test_append(self):
+        self.program.call('`` 300{`ab`+}*')
+        self.assertIs(type(self.program.stack[-1]), ost_stack.Rope)
+        self.assertEqual(self.program.evaluate(','), [600])
+        self.assertEqual(self.program.evaluate(';`` 300{.,`x`#}*,'), [300])
+
+    def test_shared(self):
+        self.assertEqual(self.program.evaluate('`a`300*`x`+.`b`+\\`c`+'),
+                         ['a' * 300 + 'xb', 'a' * 300 + 'xc'])
+
+
+@unittest.skipUnless(ost_numeric.available(), 'NumPy is not installed')
+class VectorizeTests(unittest.TestCase):
+
+    def expect_same(self, code):
+        slow = ostrich.Ostrich(vectorize=False).run(code)
+        self.assertEqual(ostrich.Ostrich().run(code), slow)
+
+    def test_map(self):
+        for blk in ['{2*}', '{1+3%}', '{.}', '{3V}', '{~A(}', '{5<}', '{;}',
+                    '{2\\-}', '{7%}', '{n}', '{2/}', '{;;}']:
+            self.expect_same('1000,' + blk + '%')
+        self.assertEqual(ost_numeric.analyze('2*1+'), [2, '*', 1, '+'])
+        self.assertIsNone(ost_numeric.analyze('2/'))
+
+    def test_fold(self):
+        for blk in ['{+}', '{-}', '{*}', '{^}', '{|}', '{&}']:
+            self.expect_same('1000,' + blk + '*')
+            self.expect_same('1000,{1+}%' + blk + '*')
+        self.expect_same('300,{100000000000*}%{*}*')
+
+
+class BudgetTests(unittest.TestCase):
+
+    def exceeded(self, code, **budget):
+        for engine in ostrich.Ostrich.ENGINES:
+            program = ostrich.Ostrich(engine=engine, **budget)
+            with self.assertRaises(ost_budget.BudgetExceeded) as cm:
+                program.call(code)
+        return cm.exception
+
+    def test_instructions(self):
+        e = self.exceeded('1 2 3 4', max_instructions=5)  # spaces count
+        self.assertEqual((e.limit, e.stack), ('instructions', [1, 2]))
+        self.assertEqual(self.exceeded('{1}(', max_instructions=1000).limit,
+                         'instructions')
+        self.assertEqual(self.exceeded('1{}99999999*',
+                                       max_instructions=1000).limit,
+                         'instructions')
+        program = ostrich.Ostrich(max_instructions=10)
+        for _ in range(3):
+            program.call('1 2+;')  # every run has its own budget
+
+    def test_time(self):
+        self.assertEqual(self.exceeded('{1}(', time_limit=0.05).limit, 'time')
+
+    def test_memory(self):
+        e = self.exceeded('9999999999,', max_memory=1 << 20)
+        self.assertEqual((e.limit, e.stack), ('memory', []))
+        self.assertEqual(self.exceeded('`ab`99999999*', max_memory=1 << 20)
+                         .limit, 'memory')
+        self.assertEqual(self.exceeded('`ab`{.+.,}(', max_memory=1 << 20)
+                         .limit, 'memory')
+        self.assertEqual(ost_budget.parse_size('64K'), 65536)
+
+
+class OptimizeTests(unittest.TestCase):
+
+    def expect(self, code, result):
+        for engine in ostrich.Ostrich.ENGINES:
+            for optimize in (False, True):
+                self.assertEqual(ostrich.Ostrich(
+                    engine=engine, optimize=optimize).run(code), result)
+
+    def ops(self, code):
+        tokens = ost_optimize.optimize(ost_cache.parsed(code))
+        self.assertEqual(len(tokens), 1)
+        code = tokens[0][1]
+        return [handler for ops in [code.ops] + [ops for ops, _, _ in code.more]
+                for handler, _ in ops]
+
+    def test_fold(self):
+        self.assertEqual(self.ops('2 3*4+ `ab`( 3 2/2*'),
+                         [ost_optimize.extend])
+        self.expect('2 3*4+ `ab`( 3 2/2*', '10 `b` `a` 3.000000')
+        # errors and big values are left for when the code runs
+        self.assertEqual(self.ops('5 0/'), [ost_optimize.extend,
+                                            ost_optimize.STOCK['/']])
+        self.assertEqual(self.ops('9999,'), [ost_optimize.push,
+                                             ost_optimize.STOCK[',']])
+
+    def test_fuse(self):
+        self.assertEqual(self.ops('3*'), [ost_optimize.number_op])
+        self.assertEqual(self.ops('.*'), [ost_optimize.dup_op])
+        self.assertEqual(self.ops('{1+}:f;'), [ost_optimize.define])
+        self.assertEqual(self.ops('{2 3+}~ '), [ost_optimize.push])
+        # the builtins still do what the operands call for
+        self.expect('`ab`3* [1].+ {1}3* 3 2/.*', '`ababab` [1 1] 1 1 1 2.250000')
+
+    def test_shadowed(self):
+        self.expect('{+}:*;2 3*', '5')
+        self.expect('{{2}:+;}~ 1 1+', '1 1 2')
+        self.expect('1 2+{3}:+;4 5+', '3 4 5 3')
+        self.expect('{1}:~;{2}~', '{2} 1')
+        # assigned to by code that optimized code ran
+        self.expect('`{2}:+;`~ 1 1+', '1 1 2')
+        self.expect('0 3{)`{5}:);`~}*', '1 5 5')
+
+    def test_budget(self):
+        # optimized code counts as the tokens it replaces
+        for code in ('2 3*4+ 5 6 7*', '{1 2+}~ 3 4', '[1 2 3]{.*}%',
+                     '0 3{)}*', '0{).3<}(', '4{(.0=})', '2{`{}:+;`~ 1 1+}*',
+                     '{:n;{0}{n(f)}n I}:f;3f'):
+            for limit in range(1, 30):
+                stacks = []
+                for optimize in (False, True):
+                    program = ostrich.Ostrich(max_instructions=limit,
+                                              optimize=optimize)
+                    try:
+                        program.call(code)
+                        stacks.append(program.render())
+                    except ost_budget.BudgetExceeded as e:
+                        stacks.append(e.stack)
+                self.assertEqual(stacks[0], stacks[1], (code, limit))
+
+
+class LoopTests(unittest.TestCase):
+
+    def expect(self, code, result):
+        OptimizeTests.expect(self, code, result)
+
+    def test_loops(self):
+        self.expect('0 1000{)}* 0{).1000<}( 1000{(.0=})', '1000 1000 0')
+        self.expect('1 10{.+}* {`a`}3*', '1024 `a` `a` `a`')
+        self.expect('{.}3*', '')
+        self.expect('0{}3*', '0')
+
+    def test_time(self):
+        # loops that never go through the engine still check the clock
+        for engine in ostrich.Ostrich.ENGINES:
+            program = ostrich.Ostrich(engine=engine, time_limit=0.05)
+            with self.assertRaises(ost_budget.BudgetExceeded) as cm:
+                program.call('0{)1}(')
+            self.assertEqual(cm.exception.limit, 'time')
+
+
+class CallTests(unittest.TestCase):
+
+    def expect(self, code, result):
+        OptimizeTests.expect(self, code, result)
+
+    def test_recursion(self):
+        # deeper than Python's own stack goes
+        self.expect('{:n;{0}{n(f)}n I}:f; 5000f', '5000')
+        # tail calls take no frame of their own
+        for engine in ostrich.Ostrich.ENGINES:
+            program = ostrich.Ostrich(engine=engine, max_depth=10)
+            self.assertEqual(program.run('{:n;{0}{n(g}n I}:g; 1000g'), '0')
+
+    def test_blocks(self):
+        self.expect('{[1 2}~3 `5 6+`~', '[1 2] 3 11')
+        # Q leaves the block ~ runs, with what it called by name
+        self.expect('{2Q3}:g;1{g 5}~4', '1 2 4')
+        self.expect('{2Q3}:g;1g 4', '1 2')
+
+    def test_depth(self):
+        e = BudgetTests.exceeded(self, '{:n;{0}{n(f)}n I}:f; 200f',
+                                 max_depth=100)
+        self.assertEqual((e.limit, e.stack[-1]), ('depth', 100))
+        self.assertEqual(BudgetTests.exceeded(self, '{[1]{f}%}:f;f').limit,
+                         'depth')
+        program = ostrich.Ostrich(max_depth=100)
+        with self.assertRaises(ost_budget.BudgetExceeded):
+            program.call('{:n;{0}{n(f)}n I}:f; 200f')
+        self.assertEqual((program.depth, program.run('; 99f')), (0, '99'))
+
+
+class BatchTests(unittest.TestCase):
+
+    JOBS = ['{"id": "a", "source": "1 2+"}',
+            '{"source": "S~+P 4", "stdin": "1 2"}',
+            '',
+            '{"source": "{1}(", "time_limit": 0.1}',
+            '{"source": "G G", "stdin": "x"}',
+            '[]']
+
+    def test_jobs(self):
+        for workers in [1, 2]:
+            results = {r['id']: r for r in ost_batch.run_batch(
+                self.JOBS, ostrich.Ostrich, {}, workers)}
+            self.assertEqual(sorted(results, key=str), [2, 4, 5, 6, 'a'])
+            self.assertEqual(results['a']['stdout'], '3')
+            self.assertEqual(results[2]['stdout'], '34')
+            self.assertEqual(results[2]['stack'], '4')
+            self.assertEqual(results[4]['status'], 'timeout')
+            self.assertEqual(results[5]['status'], 'error')
+            self.assertEqual(results[5]['stack'], '`x`')
+            self.assertIn('bad job', results[6]['error'])
+
+    def test_budget(self):
+        result, = ost_batch.run_batch(['{"source": "1 2 3{1}("}'],
+                                      ostrich.Ostrich,
+                                      {'max_instructions': 100}, 1)
+        self.assertEqual(result['status'], 'limit')
+        self.assertTrue(result['stack'].startswith('1 2 3'))
+
+    def test_bad_fields(self):
+        # a bad job does not take the others down with it
+        bad = ['"time_limit": "2"', '"time_limit": -1', '"time_limit": 0',
+               '"time_limit": true', '"stdin": 5', '"stdin": null']
+        jobs = ['{"id": "a", "source": "1 2+"}'] + [
+            '{"id": %d, "source": "1", %s}' % (i, field)
+            for i, field in enumerate(bad)] + [
+            '{"id": "b", "source": 2}', '{"id": "c", "source": "4 5+"}']
+        for workers in [1, 2]:
+            results = {r['id']: r for r in ost_batch.run_batch(
+                jobs, ostrich.Ostrich, {}, workers)}
+            self.assertEqual(results['a']['stdout'], '3')
+            self.assertEqual(results['c']['stdout'], '9')
+            for i in list(range(len(bad))) + ['b']:
+                self.assertEqual(results[i]['status'], 'error')
+                self.assertIn('bad job', results[i]['error'])
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'needs fork and Unix sockets')
+class ServerTests(unittest.TestCase):
+
+    def test_requests(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ostrich.sock')
+            server = multiprocessing.Process(
+                target=ost_server.serve,
+                args=(path, ostrich.Ostrich, {'max_instructions': 1000}, 2))
+            server.start()
+            try:
+                for _ in range(100):
+                    if os.path.exists(path): break
+                    time.sleep(0.05)
+                result = ost_server.request(path, 'S~+P 4', '1 2', id=3)
+                self.assertEqual((result['id'], result['stdout'],
+                                  result['stack']), (3, '34', '4'))
+                self.assertEqual(ost_server.request(path, '{1}(')['status'],
+                                 'limit')
+            finally:
+                server.terminate()
+                server.join()
+            self.assertFalse(os.path.exists(path))
+
+
+class DiskCacheTests(unittest.TestCase):
+
+    code = '[1 2 3]{.{2*}~+}% {1+}:f; 5f'
+
+    def test_load(self):
+        for engine, memory in (('ref', ost_cache.parsed),
+                               ('vm', ost_vm.compiled)):
+            with tempfile.TemporaryDirectory() as tmp:
+                memory.clear()
+                ost_diskcache.DiskCache((0, 1, 0), tmp).prepare(self.code,
+                                                                 engine)
+                memory.clear()
+                cache = ost_diskcache.DiskCache((0, 1, 0), tmp)
+                cache.prepare(self.code, engine)
+                self.assertEqual((cache.hits, len(memory)), (1, 4))
+                self.assertEqual(ostrich.Ostrich(engine=engine).run(
+                    self.code), '[3 6 9] 6')
+                self.assertEqual(memory.misses, 0)
+
+    def test_version(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ost_diskcache.DiskCache((0, 1, 0), tmp).prepare(self.code, 'ref')
+            cache = ost_diskcache.DiskCache((0, 2, 0), tmp)
+            self.assertFalse(cache.load(self.code, 'ref'))
+            self.assertFalse(cache.load(self.code, 'vm'))
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ost_diskcache.DiskCache((0, 1, 0), tmp, maxsize=1500)
+            for i in range(20):
+                cache.prepare('%d %s' % (i, self.code), 'ref')
+            files = os.listdir(tmp)
+            self.assertLess(len(files), 20)
+            self.assertLessEqual(sum(os.path.getsize(os.path.join(tmp, f))
+                                     for f in files), 1500)
+            self.assertTrue(cache.load('19 ' + self.code, 'ref'))
+
+
+class StartupTests(unittest.TestCase):
+
+    # what a run of ostrich.py -e imports: not the CLI modes or the modules
+    # only some builtins need
+    def test_lazy_imports(self):
+        lib = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                           'lib')
+        done = subprocess.run([sys.executable, '-X', 'importtime',
+                               os.path.join(lib, 'ostrich.py'), '-e', '1 2+'],
+                              capture_output=True, text=True)
+        self.assertEqual(done.stdout, '3')
+        modules = [line.split('|')[-1].strip()
+                   for line in done.stderr.splitlines()]
+        self.assertIn('ost_vm', modules)
+        for name in ('argparse', 're', 'random', 'math', 'multiprocessing',
+                     'ost_batch', 'ost_server', 'ost_repl'):
+            self.assertNotIn(name, modules)
+
+
+class DifferentialTests(unittest.TestCase):
+
+    def test_corpus(self):
+        self.assertEqual(differential.check(differential.CORPUS), [])
+
+    def test_random(self):
+        programs = differential.random_programs(100, seed=1)
+        self.assertEqual(differential.check(programs), [])
+
+    def test_shrink(self):
+        self.assertEqual(differential.shrink('1 2 3{4 5+}~6',
+                                             lambda code: '5' in code), '_5')
+        self.assertEqual(differential.shrink('[1 2]`ab`"c:x',
+                                             lambda code: 'x' in code), ':x')
+
+
+class OstrichVMTests(OstrichTests):
+
+    def setUp(self):
+        self.program = ostrich.Ostrich(engine='vm')
+
 if __name__ == '__main__':
     unittest.main()